@@ -0,0 +1,123 @@
+"""Benchmark turning the API's price response into a PriceSeries.
+
+Two comparisons on synthetic payloads shaped like the API's (items with
+Rank, DateTime, PriceNoTax and PriceWithTax, today and tomorrow at 15 or 60
+minute resolution):
+
+- payload_parse: the per-item parser (every DateTime through
+  _parse_iso_datetime, a dict per row, then a sort) against the bulk parser,
+  which parses two timestamps, checks the rest as strings and derives them
+  from the stride.
+- body_decode: json.loads of the whole body followed by the bulk parser,
+  against the streaming column scanner the download uses, fed in 16 KiB
+  chunks. Reports time and peak memory (tracemalloc) per body.
+
+Prints a JSON report with the median cost per payload.
+
+Usage:
+    python3 bench_parse.py [--repeat 7] [--number 200]
+"""
+import argparse
+import json
+import statistics
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import lambda_function
+
+
+def make_payload(slot_minutes, days=2):
+    """Return a payload covering `days` local days from midnight, +02:00."""
+    start = datetime(2024, 3, 5, tzinfo=timezone(timedelta(hours=2)))
+    count = days * 24 * 60 // slot_minutes
+    return [
+        {
+            "Rank": 1 + i % 24,
+            "DateTime": (start + timedelta(minutes=slot_minutes * i)).isoformat(),
+            "PriceNoTax": 0.04 + 0.001 * (i % 13),
+            "PriceWithTax": 0.05 + 0.001 * (i % 13),
+        }
+        for i in range(count)
+    ]
+
+
+def per_item_parse(payload):
+    """The parser the download used before the bulk path."""
+    entries = []
+    for item in payload:
+        dt = lambda_function._parse_iso_datetime(item.get("DateTime"))
+        price = item.get("PriceWithTax")
+        if dt is not None and price is not None:
+            entries.append({"dt": dt, "price": price})
+    entries.sort(key=lambda x: x["dt"])
+    return lambda_function.PriceSeries.from_entries(entries)
+
+
+def json_decode(body):
+    return lambda_function._series_from_payload(json.loads(body))
+
+
+def stream_decode(body):
+    scanner = lambda_function._PriceColumnScanner()
+    step = lambda_function.BODY_CHUNK_BYTES
+    for i in range(0, len(body), step):
+        scanner.feed(body[i:i + step])
+    return lambda_function._series_from_columns(*scanner.columns())
+
+
+def time_us(fn, arg, repeat, number):
+    """Median microseconds per call of fn(arg)."""
+    runs = timeit.repeat(lambda: fn(arg), repeat=repeat, number=number)
+    return statistics.median(runs) / number * 1e6
+
+
+def peak_kib(fn, arg):
+    """Peak memory allocated while running fn(arg), in KiB."""
+    tracemalloc.start()
+    try:
+        fn(arg)
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    parse_results = []
+    decode_results = []
+    for slot_minutes, days in ((60, 2), (15, 2), (15, 8)):
+        payload = make_payload(slot_minutes, days)
+        per_item = time_us(per_item_parse, payload, args.repeat, args.number)
+        bulk = time_us(lambda_function._series_from_payload, payload, args.repeat, args.number)
+        parse_results.append({
+            "slot_minutes": slot_minutes,
+            "items": len(payload),
+            "per_item_us": round(per_item, 1),
+            "bulk_us": round(bulk, 1),
+            "speedup": round(per_item / bulk, 1),
+        })
+
+        body = json.dumps(payload).encode()
+        assert list(json_decode(body)) == list(stream_decode(body))
+        decode_results.append({
+            "slot_minutes": slot_minutes,
+            "items": len(payload),
+            "body_bytes": len(body),
+            "json_us": round(time_us(json_decode, body, args.repeat, args.number), 1),
+            "stream_us": round(time_us(stream_decode, body, args.repeat, args.number), 1),
+            "json_peak_kib": round(peak_kib(json_decode, body), 1),
+            "stream_peak_kib": round(peak_kib(stream_decode, body), 1),
+        })
+
+    print(json.dumps({"payload_parse": parse_results, "body_decode": decode_results}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,18 +4,60 @@ set -e
 FUNC="AlexaSpotPriceSkill"
 ZIP="lambda.zip"
 
+# Usage: ./deploy.sh [--slim] [--build-only]
+#   --slim        Package only the runtime dependencies from
+#                 requirements-lambda.txt, drop package metadata and tests,
+#                 and ship precompiled bytecode.
+#   --build-only  Build $ZIP without uploading it.
+SLIM=0
+UPLOAD=1
+for arg in "$@"; do
+  case "$arg" in
+    --slim) SLIM=1 ;;
+    --build-only) UPLOAD=0 ;;
+    *) echo "Unknown option: $arg" >&2; exit 1 ;;
+  esac
+done
+
 # Start fresh
 rm -rf package "$ZIP"
 mkdir package
 
-echo "Installing dependencies..."
-pip install -r requirements.txt --target ./package
+if [ "$SLIM" = 1 ]; then
+  echo "Installing runtime dependencies..."
+  pip install -r requirements-lambda.txt --target ./package --no-compile
+
+  echo "Trimming package..."
+  find package -depth -type d \( -name "*.dist-info" -o -name tests -o -name __pycache__ \) -exec rm -rf {} +
+  rm -rf package/bin
+  cp lambda_function.py package/
+
+  # /var/task is read-only on Lambda, so without bytecode in the ZIP every
+  # cold start compiles all sources again. Hash-based .pyc files stay valid
+  # whatever timestamps the ZIP extraction produces. Build with the same
+  # Python minor version as the Lambda runtime, or the .pyc files are ignored.
+  echo "Compiling bytecode..."
+  python3 -m compileall -q --invalidation-mode unchecked-hash package
+
+  echo "Zipping code..."
+  cd package
+  zip -qr9 "../$ZIP" .
+  cd ..
+else
+  echo "Installing dependencies..."
+  pip install -r requirements.txt --target ./package
+
+  echo "Zipping code..."
+  cd package
+  zip -r9 "../$ZIP" .
+  cd ..
+  zip -g "$ZIP" lambda_function.py
+fi
 
-echo "Zipping code..."
-cd package
-zip -r9 "../$ZIP" .
-cd ..
-zip -g "$ZIP" lambda_function.py
+if [ "$UPLOAD" = 0 ]; then
+  echo "Built $ZIP (not uploaded)."
+  exit 0
+fi
 
 echo "Updating Lambda..."
 aws lambda update-function-code \
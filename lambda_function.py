@@ -1,7 +1,22 @@
-import json
-import requests
+import time
+
+# Taken before any other import so the startup profile covers all of module
+# init.
+_MODULE_LOAD_STARTED = time.perf_counter()
+
+import bisect
+import contextvars
+import os
+import struct
+import sys
+import threading
 import random
-from datetime import datetime, timezone
+import re
+from array import array
+from collections import deque
+from contextlib import contextmanager
+from itertools import accumulate
+from datetime import datetime, timedelta, timezone
 
 # A set of variants for the closing cue so the skill doesn't repeat the exact
 # same sentence every time. Each variant includes a short pause after the
@@ -26,6 +41,525 @@ CLOSING_CUES = [
 ]
 
 
+# Nord Pool publishes the next day's prices in the early afternoon, local time.
+# Until then the cached series cannot gain new data, so there is no point in
+# asking the API again.
+PRICES_PUBLISHED_HOUR = 14
+# Once the publication hour has passed but tomorrow's prices are still
+# missing, re-check this often (seconds).
+UNPUBLISHED_RETRY_SECONDS = 5 * 60
+
+# The parsed PriceSeries of each region, kept at module level so warm
+# invocations of the same Lambda container can answer without network I/O.
+# Maps a region code to {"entries", "expires_at"}, where `expires_at` is a
+# UTC timestamp computed by _price_cache_expiry(); see _price_cache().
+_PRICE_CACHES = {}
+
+# Serve expired cached prices while a background thread refreshes them, as
+# long as they still cover the current hour. Set to "0" to always block on
+# the refresh instead.
+STALE_WHILE_REVALIDATE = os.environ.get("STALE_WHILE_REVALIDATE", "1") != "0"
+
+# Region code -> lock held while a background refresh of that region is
+# running, so at most one per region is in flight; see _refresh_lock().
+_REFRESH_LOCKS = {}
+
+SPOT_HINTA_BASE_URL = "https://api.spot-hinta.fi"
+
+# Bidding zone used when a request doesn't name one.
+DEFAULT_REGION = os.environ.get("DEFAULT_REGION", "FI").upper()
+# Zones the scheduled warmup refreshes together, e.g. "FI,EE,SE3".
+PRICE_REGIONS = [
+    r.strip().upper() for r in os.environ.get("PRICE_REGIONS", DEFAULT_REGION).split(",") if r.strip()
+]
+# With "1", requests that don't name a zone use the one matching the device's
+# time zone setting (read once per device from the Alexa Settings API).
+REGION_FROM_DEVICE = os.environ.get("REGION_FROM_DEVICE", "0") == "1"
+
+# Zones served by the API and how they are spoken ("... in Finland").
+REGION_NAMES = {
+    "FI": "Finland",
+    "EE": "Estonia",
+    "LV": "Latvia",
+    "LT": "Lithuania",
+    "SE1": "the Luleå area",
+    "SE2": "the Sundsvall area",
+    "SE3": "the Stockholm area",
+    "SE4": "the Malmö area",
+    "NO1": "the Oslo area",
+    "NO2": "the Kristiansand area",
+    "NO3": "the Trondheim area",
+    "NO4": "the Tromsø area",
+    "NO5": "the Bergen area",
+    "DK1": "western Denmark",
+    "DK2": "eastern Denmark",
+}
+# Other words a user may say for a zone; countries map to their most
+# populous zone.
+_REGION_ALIASES = {
+    "sweden": "SE3", "lulea": "SE1", "luleå": "SE1", "sundsvall": "SE2",
+    "stockholm": "SE3", "malmo": "SE4", "malmö": "SE4",
+    "norway": "NO1", "oslo": "NO1", "kristiansand": "NO2", "trondheim": "NO3",
+    "tromso": "NO4", "tromsø": "NO4", "bergen": "NO5",
+    "denmark": "DK2", "copenhagen": "DK2", "aarhus": "DK1",
+}
+# Zones whose local time differs from the API's (Finnish) offsets; their
+# hours and days are computed in this time zone instead.
+REGION_TIMEZONES = {
+    **dict.fromkeys(("SE1", "SE2", "SE3", "SE4"), "Europe/Stockholm"),
+    **dict.fromkeys(("NO1", "NO2", "NO3", "NO4", "NO5"), "Europe/Oslo"),
+    **dict.fromkeys(("DK1", "DK2"), "Europe/Copenhagen"),
+}
+# Device time zone setting -> zone, for REGION_FROM_DEVICE.
+_TIMEZONE_REGIONS = {
+    "Europe/Helsinki": "FI", "Europe/Tallinn": "EE", "Europe/Riga": "LV",
+    "Europe/Vilnius": "LT", "Europe/Stockholm": "SE3", "Europe/Oslo": "NO1",
+    "Europe/Copenhagen": "DK2",
+}
+
+# Region of the request being handled, set by lambda_handler; threads working
+# for a region set it themselves. None means DEFAULT_REGION.
+_REQUEST_REGION = contextvars.ContextVar("request_region", default=None)
+# Device id -> zone looked up for REGION_FROM_DEVICE (None if unknown),
+# oldest first; at most DEVICE_REGIONS_MAX devices are remembered.
+_DEVICE_REGIONS = {}
+DEVICE_REGIONS_MAX = 1024
+# Upper bound for the device settings lookup, which runs before the answer.
+DEVICE_SETTINGS_TIMEOUT_SECONDS = 1.0
+# Slot length requested from the API. The Nordic day-ahead market settles in
+# 15-minute slots; 60 asks for hourly averages instead. Everything downstream
+# works on whatever resolution the data arrives in.
+PRICE_RESOLUTION_MINUTES = int(os.environ.get("PRICE_RESOLUTION_MINUTES", "15"))
+
+# Connections kept open per host by the shared HTTP session. A Lambda
+# container serves one request at a time, but the background refresh and
+# the request thread may overlap.
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "2"))
+# Open the connection to the API during container init ("1") so the first
+# fetch doesn't pay for the TCP and TLS handshake.
+PREWARM_HTTP_CONNECTION = os.environ.get("PREWARM_HTTP_CONNECTION", "0") == "1"
+
+# Created on first use by _get_http_session() and reused for the lifetime of
+# the container.
+_HTTP_SESSION = None
+_HTTP_SESSION_LOCK = threading.Lock()
+
+# Content codings to ask the API for, in order of preference. "auto" offers
+# zstd and br when the zstandard / Brotli (or brotlicffi) packages are
+# installed, plus gzip; "identity" turns compression off. An explicit list
+# such as "br,gzip" is offered as given.
+HTTP_COMPRESSION = os.environ.get("HTTP_COMPRESSION", "auto")
+# Log one JSON line per download with wire vs decoded size and decode time.
+HTTP_TRANSFER_METRICS = os.environ.get("HTTP_TRANSFER_METRICS", "0") == "1"
+
+# Decompression modules, imported on first use by _codec(); None when the
+# package isn't installed.
+_CODECS = {}
+# Size of the reads from the response stream; each chunk is decoded and
+# scanned before the next one is read.
+BODY_CHUNK_BYTES = 16 * 1024
+# Totals over the container's downloads, for the transfer metrics.
+_TRANSFER_STATS = {"responses": 0, "wire_bytes": 0, "decoded_bytes": 0, "decode_ms": 0.0}
+
+# Hedged API calls: with HEDGE_REQUESTS=1, a call that hasn't completed
+# within the HEDGE_PERCENTILE latency of recent calls gets a second,
+# identical request; whichever completes first is used and the other is
+# abandoned. Until HEDGE_MIN_SAMPLES calls have been timed the delay is
+# HEDGE_DELAY_MS. A hedge takes a rate limit token and is skipped without one.
+HEDGE_REQUESTS = os.environ.get("HEDGE_REQUESTS", "0") == "1"
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "95"))
+HEDGE_DELAY_MS = float(os.environ.get("HEDGE_DELAY_MS", "1000"))
+HEDGE_MIN_SAMPLES = 20
+# Seconds taken by recent completed API calls, body included.
+_FETCH_LATENCIES = deque(maxlen=200)
+# Totals over the container's hedged calls: "fired" second requests were
+# sent, "won" of them completed first.
+_HEDGE_STATS = {"calls": 0, "fired": 0, "won": 0}
+
+# Set STARTUP_PROFILE=1 to log, once per container, how long module init, the
+# deferred imports, the first API fetch and the first invocation took.
+STARTUP_PROFILE = os.environ.get("STARTUP_PROFILE", "0") == "1"
+
+# Filled in by _startup_stage(): stage name -> {"ms", "modules_loaded"}.
+# Only the first occurrence of each stage is recorded.
+_STARTUP_TIMINGS = {}
+_STARTUP_STATE = {"module_init_ms": None, "reported": False}
+
+# Defaults for ShouldIRunMachineIntent when the user doesn't give a duration
+# or price limit. A run is recommended when every slot it covers costs at
+# most the threshold.
+RUN_MACHINE_DURATION_MINUTES = int(os.environ.get("RUN_MACHINE_DURATION_MINUTES", "180"))
+RUN_MACHINE_THRESHOLD_CENTS = float(os.environ.get("RUN_MACHINE_THRESHOLD_CENTS", "7.0"))
+MIN_RUN_DURATION_MINUTES = 15
+MAX_RUN_DURATION_MINUTES = 12 * 60
+
+# AMAZON.DURATION slot values, e.g. PT3H, PT90M or PT1H30M.
+_ISO_DURATION_RE = re.compile(r"^P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$")
+
+_NUMBER_WORDS = [
+    "zero", "one", "two", "three", "four", "five", "six",
+    "seven", "eight", "nine", "ten", "eleven", "twelve",
+]
+
+# Alexa abandons a skill response after roughly eight seconds, regardless of
+# the Lambda timeout, so every request is budgeted against whichever is
+# shorter.
+ALEXA_RESPONSE_TIMEOUT_MS = 8000
+# Kept back from the request budget for building and returning the response.
+RESPONSE_RESERVE_MS = 250
+# Upper bound for a single API call, also used outside of a request (e.g. by
+# the background refresh).
+HTTP_TIMEOUT_SECONDS = 10
+# Below this budget a fetch is not even attempted; answering with an apology
+# right away beats timing out on the device.
+MIN_FETCH_TIMEOUT_SECONDS = 0.2
+
+TIMEOUT_MESSAGE = "I'm sorry, the electricity price service is taking too long to answer. Please try again later."
+UNAVAILABLE_MESSAGE = "I'm sorry, I couldn't retrieve the electricity price at this moment. Please try again later."
+
+# After this many consecutive failed API calls, or at once on HTTP 429, the
+# circuit opens and API calls fail fast for CIRCUIT_OPEN_SECONDS. Then a
+# single probe call is let through: success closes the circuit, failure
+# opens it again.
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "3"))
+CIRCUIT_OPEN_SECONDS = float(os.environ.get("CIRCUIT_OPEN_SECONDS", "30"))
+
+# Client-side limit on API calls: a token bucket refilled at
+# UPSTREAM_RATE_PER_MINUTE holding at most UPSTREAM_BURST calls. A
+# Retry-After from the API blocks calls until it has passed. With
+# UPSTREAM_RATE_LIMIT_SHARED=1 and a SQLite PRICE_STORE, the bucket lives in
+# the store and is shared by every process using it.
+UPSTREAM_RATE_PER_MINUTE = float(os.environ.get("UPSTREAM_RATE_PER_MINUTE", "12"))
+UPSTREAM_BURST = int(os.environ.get("UPSTREAM_BURST", "4"))
+UPSTREAM_RATE_LIMIT_SHARED = os.environ.get("UPSTREAM_RATE_LIMIT_SHARED", "0") == "1"
+
+# Created on first use by _upstream_limiter().
+_UPSTREAM_LIMITER = None
+
+# Deadline of the request being handled, set by lambda_handler. Background
+# threads don't inherit it and use the plain HTTP_TIMEOUT_SECONDS.
+_REQUEST_DEADLINE = contextvars.ContextVar("request_deadline", default=None)
+
+# Final SSML bodies (before the closing cue) of the intents, which are the
+# same for every user of a region within a price slot. `regions` maps a
+# region code to {"version", "slot", "answers"}: `answers` maps (intent, slot
+# values...) to SSML and only holds answers for data `version` in price slot
+# `slot`; when either changes that region's cache starts over.
+_ANSWER_CACHE = {"regions": {}, "hits": 0, "misses": 0}
+
+# Where the parsed series is stored beyond the memory of one container:
+#   "file"                  a file in PRICE_CACHE_DIR (default; /tmp lives as
+#                           long as the execution environment)
+#   "sqlite:/path/to.db"    a SQLite database, a local stand-in for a shared
+#                           store (several processes on one host, tests)
+#   "s3://bucket/prefix"    S3 objects (prefix/<region>.bin) shared by all
+#                           containers
+PRICE_STORE = os.environ.get("PRICE_STORE", "file")
+PRICE_CACHE_DIR = os.environ.get("PRICE_CACHE_DIR", "/tmp")
+# File name in PRICE_CACHE_DIR, per region.
+PRICE_CACHE_FILE = "spot_prices_{region}.bin"
+# Name of the series within a SQLite store (suffixed with ":<region>"), and
+# the object key prefix of an S3 store without one.
+PRICE_STORE_KEY = "spot_prices"
+
+# With "1", only scheduled warmup invocations (or requests with no usable data
+# at all) call the API; requests holding stale prices re-read the shared store
+# instead, so the upstream request rate doesn't grow with the container count.
+PRICE_STORE_REFRESHER_ONLY = os.environ.get("PRICE_STORE_REFRESHER_ONLY", "0") == "1"
+
+# Built on first use by _price_store().
+_PRICE_STORE_INSTANCE = {"spec": None, "store": None}
+
+# Stored series layout: a fixed header followed by `count` int64 UTC
+# timestamps, `count` float64 prices and the response validators. The
+# header carries the expiry so a stale copy can be rejected without reading
+# the body.
+_DISK_CACHE_MAGIC = b"SPPC"
+_DISK_CACHE_VERSION = 2
+# magic, format version, entry count, expires_at, tz offset in seconds,
+# byte lengths of the ETag and Last-Modified stored after the prices
+_DISK_CACHE_HEADER = struct.Struct("<4sHIdiHH")
+
+
+@contextmanager
+def _startup_stage(name):
+    """Time the first run of a startup stage when STARTUP_PROFILE is on."""
+    if not STARTUP_PROFILE or name in _STARTUP_TIMINGS:
+        yield
+        return
+    started = time.perf_counter()
+    modules_before = len(sys.modules)
+    try:
+        yield
+    finally:
+        _STARTUP_TIMINGS[name] = {
+            "ms": round((time.perf_counter() - started) * 1000, 3),
+            "modules_loaded": len(sys.modules) - modules_before,
+        }
+
+
+def _startup_report():
+    """Return the startup profile collected so far."""
+    return {
+        "module_init_ms": _STARTUP_STATE["module_init_ms"],
+        "stages": dict(_STARTUP_TIMINGS),
+        "modules_loaded": len(sys.modules),
+        "python": sys.version.split()[0],
+    }
+
+
+def _emit_startup_report():
+    """Print the startup profile as one JSON line (picked up by CloudWatch
+    Logs), once per container."""
+    if not STARTUP_PROFILE or _STARTUP_STATE["reported"]:
+        return
+    _STARTUP_STATE["reported"] = True
+    import json
+
+    print(json.dumps({"startup_profile": _startup_report()}))
+
+
+class Deadline:
+    """Point in (monotonic) time by which the current request must answer."""
+
+    __slots__ = ("expires_at",)
+
+    def __init__(self, budget_ms):
+        self.expires_at = time.monotonic() + budget_ms / 1000
+
+    @classmethod
+    def from_context(cls, context):
+        """Build the deadline for a Lambda invocation.
+
+        Uses the Lambda's remaining time when available, capped at the Alexa
+        response window, minus RESPONSE_RESERVE_MS for rendering."""
+        budget_ms = ALEXA_RESPONSE_TIMEOUT_MS
+        get_remaining = getattr(context, "get_remaining_time_in_millis", None)
+        if get_remaining is not None:
+            budget_ms = min(budget_ms, get_remaining())
+        return cls(max(budget_ms - RESPONSE_RESERVE_MS, 0))
+
+    def remaining(self):
+        """Seconds left before the deadline (never negative)."""
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+    def budget(self, cap):
+        """Return the time a stage may take: what's left, but at most `cap`."""
+        return min(cap, self.remaining())
+
+
+def _fetch_timeout():
+    """Return the timeout for an API call made on behalf of the current
+    request, or None if there's no time left to make one."""
+    deadline = _REQUEST_DEADLINE.get()
+    if deadline is None:
+        return HTTP_TIMEOUT_SECONDS
+    timeout = deadline.budget(HTTP_TIMEOUT_SECONDS)
+    if timeout < MIN_FETCH_TIMEOUT_SECONDS:
+        return None
+    return timeout
+
+
+def _deadline_expired():
+    deadline = _REQUEST_DEADLINE.get()
+    return deadline is not None and deadline.expired()
+
+
+class CircuitBreaker:
+    """Fail fast while the upstream is failing.
+
+    Closed: calls go through and consecutive failures are counted. Open:
+    calls are refused until `open_seconds` have passed, and the error of the
+    last failure is kept so it can be answered without waiting on the
+    network. Half-open: one probe call goes through and decides whether to
+    close or re-open.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=None, open_seconds=None):
+        self.failure_threshold = failure_threshold or CIRCUIT_FAILURE_THRESHOLD
+        self.open_seconds = CIRCUIT_OPEN_SECONDS if open_seconds is None else open_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a call may be made now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+                # This caller becomes the probe; others keep failing fast.
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.last_error = None
+
+    def release(self):
+        """Give up a half-open probe that was allowed but never made, so the
+        next caller probes instead."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def record_failure(self, error, trip=False):
+        """Count a failed call. `trip` opens the circuit at once (e.g. when
+        the upstream asked us to back off)."""
+        with self._lock:
+            self.failures += 1
+            self.last_error = error
+            if trip or self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+# Region code -> breaker guarding the price API calls for that region, so
+# one zone failing doesn't stop the others; see _upstream_breaker().
+_UPSTREAM_BREAKERS = {}
+
+
+def _upstream_breaker(region):
+    """Return the circuit breaker of `region`."""
+    breaker = _UPSTREAM_BREAKERS.get(region)
+    if breaker is None:
+        breaker = _UPSTREAM_BREAKERS.setdefault(region, CircuitBreaker())
+    return breaker
+
+
+class TokenBucket:
+    """Client-side rate limiter for API calls.
+
+    Holds up to `capacity` tokens, refilled continuously at
+    `rate_per_minute`; every call takes one. defer() blocks all calls until
+    a point in time, which is how Retry-After is honored. State is
+    (tokens, updated_at, blocked_until) in wall-clock time so that it can be
+    shared between processes (see SQLiteTokenBucket).
+    """
+
+    def __init__(self, rate_per_minute, capacity):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity
+        self._state = (float(capacity), time.time(), 0.0)
+        self._lock = threading.Lock()
+
+    def _update(self, fn):
+        """Apply fn(state) -> (new_state, result) atomically; return result."""
+        with self._lock:
+            self._state, result = fn(self._state)
+        return result
+
+    def _take(self, state):
+        tokens, updated_at, blocked_until = state
+        now = time.time()
+        tokens = min(self.capacity, tokens + max(now - updated_at, 0) * self.rate)
+        if now < blocked_until:
+            return (tokens, now, blocked_until), blocked_until - now
+        if tokens >= 1:
+            return (tokens - 1, now, blocked_until), 0.0
+        return (tokens, now, blocked_until), (1 - tokens) / self.rate
+
+    def acquire(self, timeout):
+        """Take a token, waiting up to `timeout` seconds for one. Returns
+        False at once if none will be available in time."""
+        give_up_at = time.monotonic() + timeout
+        while True:
+            wait = self._update(self._take)
+            if wait == 0:
+                return True
+            if time.monotonic() + wait > give_up_at:
+                return False
+            time.sleep(wait)
+
+    def defer(self, seconds):
+        """Refuse calls for the next `seconds`."""
+        until = time.time() + seconds
+        self._update(lambda state: ((state[0], state[1], max(state[2], until)), None))
+
+
+class SQLiteTokenBucket(TokenBucket):
+    """TokenBucket whose state lives in a SQLite database, so every process
+    opening it shares one rate limit. Falls back to a process-local bucket
+    if the database can't be used."""
+
+    def __init__(self, path, rate_per_minute, capacity):
+        super().__init__(rate_per_minute, capacity)
+        self.path = path
+
+    def _update(self, fn):
+        import sqlite3
+
+        try:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            try:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS rate_limit (name TEXT PRIMARY KEY, "
+                    "tokens REAL NOT NULL, updated_at REAL NOT NULL, blocked_until REAL NOT NULL)"
+                )
+                # Take the write lock before reading, so that concurrent
+                # processes can't both spend the same token.
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    "SELECT tokens, updated_at, blocked_until FROM rate_limit WHERE name = ?",
+                    (PRICE_STORE_KEY,),
+                ).fetchone()
+                state, result = fn(row or (float(self.capacity), time.time(), 0.0))
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_limit VALUES (?, ?, ?, ?)",
+                    (PRICE_STORE_KEY, *state),
+                )
+                conn.execute("COMMIT")
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return super()._update(fn)
+        return result
+
+
+def _upstream_limiter():
+    """Return the rate limiter for API calls, created on first use."""
+    global _UPSTREAM_LIMITER
+    if _UPSTREAM_LIMITER is None:
+        # A warmup pass over every region must fit in one burst.
+        burst = max(UPSTREAM_BURST, len(PRICE_REGIONS))
+        if UPSTREAM_RATE_LIMIT_SHARED and PRICE_STORE.startswith("sqlite:"):
+            _UPSTREAM_LIMITER = SQLiteTokenBucket(
+                PRICE_STORE[len("sqlite:"):], UPSTREAM_RATE_PER_MINUTE, burst
+            )
+        else:
+            _UPSTREAM_LIMITER = TokenBucket(UPSTREAM_RATE_PER_MINUTE, burst)
+    return _UPSTREAM_LIMITER
+
+
+def _parse_retry_after(value):
+    """Return the delay in seconds requested by a Retry-After header (either
+    delta-seconds or an HTTP date), or None if it can't be parsed."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    from email.utils import parsedate_to_datetime
+
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(when.timestamp() - time.time(), 0.0)
+
+
 def _choose_closing_cue():
     # Use random.choice for variety; tests check for presence of any variant.
     return random.choice(CLOSING_CUES)
@@ -47,6 +581,522 @@ def _parse_iso_datetime(s):
         return None
 
 
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _series_from_payload(data):
+    """Build a PriceSeries from the API's list of {"DateTime", "PriceWithTax"}
+    items, or return None if none of them is usable."""
+    datetimes = [item.get('DateTime') for item in data]
+    prices = [item.get('PriceWithTax') for item in data]
+    return _series_from_columns(datetimes, prices)
+
+
+def _series_from_columns(datetimes, prices):
+    """Build a PriceSeries from parallel DateTime strings and prices, or
+    return None if no pair is usable.
+
+    The API returns evenly spaced slots in ascending order, so usually only
+    two timestamps need parsing: if every other DateTime string matches the
+    stride they set, slot times are derived arithmetically. Irregular
+    payloads (gaps, duplicates, misordered or malformed items) go through
+    the per-item parser instead."""
+    series = _series_from_regular_columns(datetimes, prices)
+    if series is None:
+        series = _series_from_items(datetimes, prices)
+    return series
+
+
+def _series_from_regular_columns(datetimes, prices):
+    """Fast path of _series_from_columns(); None if the data isn't regular."""
+    n = len(datetimes)
+    if n == 0:
+        return None
+    try:
+        price_column = array('d', prices)
+    except TypeError:
+        # Null or non-numeric prices.
+        return None
+
+    first = _parse_iso_datetime(datetimes[0])
+    if first is None:
+        return None
+    start = int(first.timestamp())
+    stride = 0
+    if n > 1:
+        second = _parse_iso_datetime(datetimes[1])
+        if second is None:
+            return None
+        stride = int(second.timestamp()) - start
+        if stride <= 0 or not _on_grid(datetimes, first, stride):
+            return None
+
+    timestamps = range(start, start + n * stride, stride) if stride else (start,)
+    return PriceSeries(timestamps, price_column, first.tzinfo or timezone.utc)
+
+
+# Wall-clock times ("HH:MM") of one day's slots, per stride; see _on_grid().
+_DAY_CLOCKS = {}
+
+
+def _on_grid(datetimes, first, stride):
+    """Return True if every string in `datetimes` is the slot at its index
+    on the grid starting at `first` (the first one, parsed) with `stride`
+    seconds.
+
+    Compares strings instead of parsing them: the expected strings are the
+    slots' dates and wall-clock times joined with the first one's seconds
+    and UTC offset. Series spanning a DST change (two offsets) or with a
+    stride that doesn't divide the day fail and are parsed item by item."""
+    if stride % 60 or 86400 % stride:
+        return False
+    second_of_day = first.hour * 3600 + first.minute * 60
+    if second_of_day % stride:
+        return False
+    clocks = _DAY_CLOCKS.get(stride)
+    if clocks is None:
+        clocks = _DAY_CLOCKS[stride] = [
+            f"{t // 3600:02d}:{t % 3600 // 60:02d}" for t in range(0, 86400, stride)
+        ]
+    # "YYYY-MM-DDTHH:MM" is followed by the same seconds and offset in
+    # every item.
+    suffix = datetimes[0][16:]
+    clocks = [clock + suffix for clock in clocks]
+
+    n = len(datetimes)
+    dates = []
+    times = []
+    slot = second_of_day // stride
+    day = first.date()
+    while len(times) < n:
+        day_times = clocks[slot:slot + n - len(times)]
+        times += day_times
+        dates += [day.isoformat() + "T"] * len(day_times)
+        slot = 0
+        day += timedelta(days=1)
+    return list(map(str.__add__, dates, times)) == datetimes
+
+
+def _series_from_items(datetimes, prices):
+    """Parse every item on its own, dropping unusable ones, and sort."""
+    entries = []
+    for value, price in zip(datetimes, prices):
+        dt = _parse_iso_datetime(value)
+        if dt is not None and price is not None:
+            entries.append({"dt": dt, "price": price})
+
+    if not entries:
+        return None
+
+    entries.sort(key=lambda x: x['dt'])
+    return PriceSeries.from_entries(entries)
+
+
+# The two fields of the API's items that the skill uses. The patterns rely
+# on the API's compact "key": value layout; a body laid out differently
+# fails the scanner's count check and is parsed with json.loads.
+_DATETIME_FIELD_RE = re.compile(rb'"DateTime":\s*"([^"\\]*)"')
+_PRICE_FIELD_RE = re.compile(rb'"PriceWithTax":\s*([^,}\s]*)')
+
+
+class _PriceColumnScanner:
+    """Extract DateTime and PriceWithTax columns from the API's JSON as the
+    body arrives.
+
+    Each chunk is scanned up to its last complete item, one regular
+    expression per field, so the values go straight into the columns
+    without the per-item dicts (and every other field) json.loads would
+    build. A body of any other shape marks the scan as failed, and the
+    caller parses it with json.loads instead.
+    """
+
+    __slots__ = ("datetimes", "prices", "ok", "_buffer", "_started")
+
+    def __init__(self):
+        self.datetimes = []
+        self.prices = []
+        self.ok = True
+        self._buffer = b""
+        self._started = False
+
+    def feed(self, chunk):
+        if not self.ok:
+            return
+        buffer = self._buffer + chunk if self._buffer else chunk
+        if not self._started:
+            stripped = buffer.lstrip()
+            if not stripped:
+                return
+            if stripped[:1] != b"[":
+                self.ok = False
+                return
+            self._started = True
+
+        # An item split across chunks waits for the rest.
+        end = buffer.rfind(b"}") + 1
+        datetimes = _DATETIME_FIELD_RE.findall(buffer, 0, end)
+        prices = _PRICE_FIELD_RE.findall(buffer, 0, end)
+        # Exactly one of each field per object, and no nested objects.
+        items = buffer.count(b"{", 0, end)
+        if not len(datetimes) == len(prices) == items == buffer.count(b"}", 0, end):
+            self.ok = False
+            return
+        self._buffer = buffer[end:]
+
+        try:
+            prices = list(map(float, prices))
+        except ValueError:
+            try:
+                prices = [None if p == b"null" else float(p) for p in prices]
+            except ValueError:
+                self.ok = False
+                return
+        self.datetimes.extend(map(bytes.decode, datetimes))
+        self.prices.extend(prices)
+
+    def columns(self):
+        """Return (datetimes, prices) once the whole body has been fed, or
+        None if it wasn't a non-empty array of price items."""
+        if not self.ok or not self.datetimes or self._buffer.strip() != b"]":
+            return None
+        return self.datetimes, self.prices
+
+
+class PriceSeries:
+    """Price entries stored as parallel columns.
+
+    `timestamps` holds the slot start times as ascending UTC epoch seconds and
+    `prices` the matching prices in EUR/kWh. `tz` is the timezone local dates
+    and hours are computed in (the API's own offset). Because `timestamps` is
+    sorted it doubles as the lookup index: the slot containing an instant and
+    the first slot of a local day are found by bisection, so intent handlers
+    can slice "today" or "tomorrow" without building a datetime per entry.
+
+    Indexing still yields the {"dt": datetime, "price": float} dicts used
+    throughout the skill.
+
+    `validators` holds the ETag and Last-Modified of the API response the
+    series was parsed from, for revalidating it with a conditional request.
+    """
+
+    __slots__ = ("timestamps", "prices", "tz", "validators", "_day_bounds", "_hourly", "_version")
+
+    def __init__(self, timestamps, prices, tz, validators=None):
+        self.timestamps = array('q', timestamps)
+        self.prices = array('d', prices)
+        self.tz = tz
+        # {"etag": str | None, "last_modified": str | None}, or None
+        self.validators = validators
+        # local date -> (start, end) index range, filled in by day_range()
+        self._day_bounds = {}
+        # hourly aggregate, built on first use by hourly()
+        self._hourly = None
+        # content fingerprint, computed on first use by version()
+        self._version = None
+
+    @classmethod
+    def from_entries(cls, entries):
+        """Build a series from a list of {"dt", "price"} dicts sorted by time."""
+        tz = entries[0]['dt'].tzinfo or timezone.utc
+        return cls(
+            (int(e['dt'].timestamp()) for e in entries),
+            (e['price'] for e in entries),
+            tz,
+        )
+
+    @classmethod
+    def coerce(cls, entries):
+        """Return `entries` as a PriceSeries, converting an entry list."""
+        if isinstance(entries, cls):
+            return entries
+        return cls.from_entries(entries)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return {"dt": self.dt(i), "price": self.prices[i]}
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def dt(self, i):
+        """Return the start of slot `i` as a datetime in the series' timezone."""
+        if i < 0:
+            i += len(self.timestamps)
+        return (_EPOCH + timedelta(seconds=self.timestamps[i])).astimezone(self.tz)
+
+    def slot_seconds(self):
+        """Length of a slot, assuming regular spacing (an hour if unknown)."""
+        if len(self.timestamps) > 1:
+            return self.timestamps[-1] - self.timestamps[-2]
+        return 3600
+
+    def localize(self, tz):
+        """Compute local dates and hours in `tz` from now on."""
+        self.tz = tz
+        self._day_bounds = {}
+        self._hourly = None
+        self._version = None
+
+    def version(self):
+        """Return a fingerprint of the series' content: series holding the
+        same prices share a version, a refresh with new data changes it."""
+        if self._version is None:
+            self._version = hash((self.timestamps.tobytes(), self.prices.tobytes(), self.tz))
+        return self._version
+
+    def slot_start(self, ts):
+        """Return the start of the slot grid cell containing UTC timestamp
+        `ts`, whether or not the series has data for it."""
+        return ts - (ts - self.timestamps[0]) % self.slot_seconds()
+
+    def hourly(self):
+        """Return the series aggregated to one average price per hour.
+
+        Series that are already hourly (or coarser) are returned as is; the
+        aggregate is computed once and kept with the series."""
+        if self._hourly is None:
+            if self.slot_seconds() >= 3600:
+                self._hourly = self
+            else:
+                hours = array('q')
+                sums = []
+                counts = []
+                for ts, price in zip(self.timestamps, self.prices):
+                    hour = ts - ts % 3600
+                    if hours and hours[-1] == hour:
+                        sums[-1] += price
+                        counts[-1] += 1
+                    else:
+                        hours.append(hour)
+                        sums.append(price)
+                        counts.append(1)
+                averages = (total / n for total, n in zip(sums, counts))
+                self._hourly = PriceSeries(hours, averages, self.tz)
+        return self._hourly
+
+    def slot_index(self, ts):
+        """Return the index of the slot containing UTC timestamp `ts`, i.e. the
+        last slot starting at or before it; -1 if `ts` precedes the series."""
+        return bisect.bisect_right(self.timestamps, ts) - 1
+
+    def first_index_from(self, ts, lo=0, hi=None):
+        """Return the index of the first slot starting at or after `ts`."""
+        if hi is None:
+            hi = len(self.timestamps)
+        return bisect.bisect_left(self.timestamps, ts, lo, hi)
+
+    def day_start_index(self, day):
+        """Return the index of the first slot on or after local midnight of
+        date `day`."""
+        midnight = self.dt(0).replace(
+            year=day.year, month=day.month, day=day.day,
+            hour=0, minute=0, second=0, microsecond=0,
+        )
+        return self.first_index_from(midnight.timestamp())
+
+    def day_range(self, day):
+        """Return the (start, end) index range of the slots on local date
+        `day`; empty if the series doesn't cover it."""
+        bounds = self._day_bounds.get(day)
+        if bounds is None:
+            bounds = (self.day_start_index(day), self.day_start_index(day + timedelta(days=1)))
+            self._day_bounds[day] = bounds
+        return bounds
+
+    def last_day(self):
+        return self.dt(-1).date()
+
+    def is_contiguous(self, start, end):
+        """Return True if slots [start, end) follow each other without gaps."""
+        if end - start < 2:
+            return True
+        span = self.timestamps[end - 1] - self.timestamps[start]
+        return span == (end - 1 - start) * self.slot_seconds()
+
+
+# Prices are summed as integers in this unit (1e-7 EUR) so that windows with
+# equal totals compare equal and ties resolve to the earliest window.
+_PRICE_SUM_SCALE = 10_000_000
+
+
+class PriceWindows:
+    """Statistics of every window of `k` contiguous slots in prices[start:end].
+
+    Window sums come from prefix sums and window maxima from a monotonic
+    deque, both built in one O(n) pass, so the cheapest window or all windows
+    under a threshold are found without re-summing each candidate. Windows
+    are identified by the absolute index of their first slot.
+    """
+
+    __slots__ = ("start", "k", "sums", "maxima")
+
+    def __init__(self, prices, start, end, k):
+        self.start = start
+        self.k = k
+        self.sums = []
+        self.maxima = []
+        if k <= 0 or end - start < k:
+            return
+
+        prefix = list(accumulate(
+            (round(prices[i] * _PRICE_SUM_SCALE) for i in range(start, end)),
+            initial=0,
+        ))
+        self.sums = [prefix[j + k] - prefix[j] for j in range(end - start - k + 1)]
+
+        # Indices whose prices are strictly decreasing; the front is the
+        # maximum of the current window.
+        candidates = deque()
+        for i in range(start, end):
+            while candidates and prices[candidates[-1]] <= prices[i]:
+                candidates.pop()
+            candidates.append(i)
+            if candidates[0] <= i - k:
+                candidates.popleft()
+            if i - start >= k - 1:
+                self.maxima.append(prices[candidates[0]])
+
+    def __len__(self):
+        return len(self.sums)
+
+    def max_at(self, i):
+        """Highest price in the window starting at index `i`."""
+        return self.maxima[i - self.start]
+
+    def _offsets(self, lo, hi):
+        """Translate an absolute [lo, hi) range of start indices into
+        positions in `sums`/`maxima`, defaulting to all windows."""
+        first = 0 if lo is None else max(lo - self.start, 0)
+        last = len(self.sums) if hi is None else min(hi - self.start, len(self.sums))
+        return first, max(last, first)
+
+    def cheapest(self, lo=None, hi=None):
+        """Start index of the window with the lowest total (earliest on ties),
+        or None if there are no windows. `lo`/`hi` restrict the start index."""
+        first, last = self._offsets(lo, hi)
+        if first == last:
+            return None
+        best = min(range(first, last), key=self.sums.__getitem__)
+        return self.start + best
+
+    def at_most_cents(self, limit, lo=None, hi=None):
+        """Start indices of all windows whose every price is <= `limit` cents."""
+        first, last = self._offsets(lo, hi)
+        return [self.start + j for j in range(first, last) if self.maxima[j] * 100 <= limit]
+
+    def earliest_at_most_cents(self, limit, lo=None, hi=None):
+        """Start index of the first window whose prices are all <= `limit`
+        cents, or None."""
+        first, last = self._offsets(lo, hi)
+        for j in range(first, last):
+            if self.maxima[j] * 100 <= limit:
+                return self.start + j
+        return None
+
+
+def _current_region():
+    """Return the region code of the request being handled."""
+    return _REQUEST_REGION.get() or DEFAULT_REGION
+
+
+def _region_name(region=None):
+    """Return how `region` (default: the current one) is spoken."""
+    region = region or _current_region()
+    return REGION_NAMES.get(region, region)
+
+
+def _parse_region(value):
+    """Return the region code for a spoken or written zone ("SE3",
+    "Stockholm", "Finland"), or None if it isn't one the API serves."""
+    if not value:
+        return None
+    code = "".join(value.split()).replace("-", "").upper()
+    if code in REGION_NAMES:
+        return code
+    key = " ".join(value.lower().split())
+    for region, name in REGION_NAMES.items():
+        if key == name.lower() or key == name.lower().removeprefix("the "):
+            return region
+    return _REGION_ALIASES.get(key)
+
+
+def _region_timezone(region):
+    """Return the tzinfo `region`'s hours are computed in, or None to keep
+    the API's own offsets."""
+    name = REGION_TIMEZONES.get(region)
+    if name is None:
+        return None
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+    try:
+        return ZoneInfo(name)
+    except ZoneInfoNotFoundError:
+        # No time zone database in the runtime: keep the API's offsets.
+        return None
+
+
+def _localize(series, region):
+    """Switch `series` to `region`'s local time zone where it differs from
+    the API's. Returns `series`."""
+    tz = _region_timezone(region)
+    if tz is not None and series.tz != tz:
+        series.localize(tz)
+    return series
+
+
+def _refresh_lock(region):
+    """Return the background refresh lock of `region`."""
+    lock = _REFRESH_LOCKS.get(region)
+    if lock is None:
+        lock = _REFRESH_LOCKS.setdefault(region, threading.Lock())
+    return lock
+
+
+def _price_cache(region=None):
+    """Return the memory cache entry of `region` (default: the current one)."""
+    return _PRICE_CACHES.setdefault(region or _current_region(), {"entries": None, "expires_at": 0.0})
+
+
+def _cached_answer(series, key, compute):
+    """Return the answer for `key` computed from `series` (the current
+    region's prices) in the current price slot, calling `compute(series)`
+    only on a cache miss."""
+    slot = series.slot_start(datetime.now(timezone.utc).timestamp())
+    version = series.version()
+    cache = _ANSWER_CACHE
+    region = _current_region()
+    entry = cache["regions"].get(region)
+    if entry is None or entry["version"] != version or entry["slot"] != slot:
+        # New prices or a new slot: every stored answer is out of date.
+        entry = cache["regions"][region] = {"version": version, "slot": slot, "answers": {}}
+
+    answers = entry["answers"]
+    ssml = answers.get(key)
+    if ssml is None:
+        cache["misses"] += 1
+        ssml = answers[key] = compute(series)
+    else:
+        cache["hits"] += 1
+    return ssml
+
+
+def _load_price_series():
+    """Return (PriceSeries, error_message) for the currently cached prices."""
+    entries, error = _fetch_all_price_entries()
+    if error:
+        return None, error
+    # The read timeout applies per socket read, so a slowly trickling body
+    # can overrun the request budget. Its prices are cached and stored for
+    # the requests that follow; only this answer is too late.
+    if _deadline_expired():
+        return None, TIMEOUT_MESSAGE
+    return PriceSeries.coerce(entries), None
+
+
 def get_spot_price():
     # Keep previous behavior by delegating to a helper that returns a plain text
     entries, error = _get_price_entries(4)
@@ -61,7 +1111,7 @@ def get_spot_price():
     next2 = fmt_cents(entries[2]['price']) if len(entries) > 2 else None
     next3 = fmt_cents(entries[3]['price']) if len(entries) > 3 else None
 
-    message = f"The current electricity spot price in Finland is {curr_price} cents per kilowatt-hour."
+    message = f"The current electricity spot price in {_region_name()} is {curr_price} cents per kilowatt-hour."
 
     parts = []
     if next1 is not None:
@@ -85,67 +1135,913 @@ def get_spot_price():
     return message
 
 
+def _price_cache_expiry(series, now):
+    """Return the UTC timestamp after which the cached `series` must be
+    refreshed.
+
+    Published prices never change, so expiry follows the publication cycle
+    instead of a fixed TTL: if tomorrow's prices are already known nothing new
+    appears until tomorrow afternoon; otherwise they are due today at
+    PRICES_PUBLISHED_HOUR, after which we re-check every few minutes until
+    they show up.
+    """
+    now_local = now.astimezone(series.tz)
+    today = now_local.date()
+    last_day = series.last_day()
+
+    if last_day < today:
+        # The data doesn't even cover today; refresh right away.
+        return now.timestamp()
+
+    publish_at = now_local.replace(
+        hour=PRICES_PUBLISHED_HOUR, minute=0, second=0, microsecond=0
+    ) + timedelta(days=(last_day - today).days)
+
+    if publish_at <= now_local:
+        return now.timestamp() + UNPUBLISHED_RETRY_SECONDS
+    return publish_at.timestamp()
+
+
+def _encode_series(series, expires_at):
+    """Serialize `series` and its expiry into the stored binary layout."""
+    offset = series.dt(0).utcoffset() or timedelta(0)
+    validators = series.validators or {}
+    etag = (validators.get("etag") or "").encode()
+    last_modified = (validators.get("last_modified") or "").encode()
+    if max(len(etag), len(last_modified)) > 0xFFFF:
+        # Too long for the header's length fields: store the prices without
+        # them, at the cost of one unconditional request.
+        etag = last_modified = b""
+    header = _DISK_CACHE_HEADER.pack(
+        _DISK_CACHE_MAGIC, _DISK_CACHE_VERSION, len(series), expires_at,
+        int(offset.total_seconds()), len(etag), len(last_modified),
+    )
+    return b"".join((
+        header, series.timestamps.tobytes(), series.prices.tobytes(), etag, last_modified,
+    ))
+
+
+def _decode_series(data):
+    """Return (series, expires_at) from the stored binary layout, or None if
+    `data` is missing or malformed."""
+    if not data or len(data) < _DISK_CACHE_HEADER.size:
+        return None
+    (magic, version, count, expires_at, offset,
+     etag_len, last_modified_len) = _DISK_CACHE_HEADER.unpack_from(data)
+    if magic != _DISK_CACHE_MAGIC or version != _DISK_CACHE_VERSION or count == 0:
+        return None
+
+    body = memoryview(data)[_DISK_CACHE_HEADER.size:]
+    width = 8 * count
+    if len(body) != 2 * width + etag_len + last_modified_len:
+        return None
+    timestamps = array('q')
+    timestamps.frombytes(body[:width])
+    prices = array('d')
+    prices.frombytes(body[width:2 * width])
+    try:
+        etag = bytes(body[2 * width:2 * width + etag_len]).decode()
+        last_modified = bytes(body[2 * width + etag_len:]).decode()
+        tz = timezone(timedelta(seconds=offset))
+    except ValueError:
+        # Validators that aren't UTF-8 or an offset out of range.
+        return None
+
+    validators = None
+    if etag or last_modified:
+        validators = {"etag": etag or None, "last_modified": last_modified or None}
+    series = PriceSeries(timestamps, prices, tz, validators)
+    return series, expires_at
+
+
+class FilePriceStore:
+    """Price store in a local file.
+
+    With the default /tmp directory the file is private to one execution
+    environment, but it outlives container recycles within the same day.
+    Failures are ignored: the store is only an optimization.
+    """
+
+    def __init__(self, directory=None):
+        # None follows PRICE_CACHE_DIR, read at use time.
+        self.directory = directory
+
+    def path(self, region):
+        return os.path.join(self.directory or PRICE_CACHE_DIR, PRICE_CACHE_FILE.format(region=region))
+
+    def load(self, region):
+        try:
+            with open(self.path(region), "rb") as f:
+                return _decode_series(f.read())
+        except OSError:
+            return None
+
+    def save(self, region, series, expires_at):
+        path = self.path(region)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(_encode_series(series, expires_at))
+            # Atomic rename so concurrent readers never see a partial file.
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+class SQLitePriceStore:
+    """Price store in a SQLite database.
+
+    A local stand-in for a shared store: every process that opens the same
+    database file sees the series written by any of them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _connect(self):
+        import sqlite3
+
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS price_series "
+            "(name TEXT PRIMARY KEY, payload BLOB NOT NULL)"
+        )
+        return conn
+
+    def load(self, region):
+        import sqlite3
+
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT payload FROM price_series WHERE name = ?",
+                    (f"{PRICE_STORE_KEY}:{region}",),
+                ).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return None
+        return _decode_series(row[0]) if row else None
+
+    def save(self, region, series, expires_at):
+        import sqlite3
+
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO price_series (name, payload) VALUES (?, ?)",
+                        (f"{PRICE_STORE_KEY}:{region}", _encode_series(series, expires_at)),
+                    )
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            pass
+
+
+class S3PriceStore:
+    """Price store in S3 objects shared by all containers, one per region
+    under `prefix`.
+
+    Uses boto3, which the Lambda Python runtime provides; the function's role
+    needs s3:GetObject and s3:PutObject on the objects.
+    """
+
+    def __init__(self, bucket, prefix):
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+        self._client = None
+
+    def key(self, region):
+        return f"{self.prefix}/{region}.bin"
+
+    def _s3(self):
+        if self._client is None:
+            import boto3
+
+            self._client = boto3.client("s3")
+        return self._client
+
+    def load(self, region):
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        try:
+            response = self._s3().get_object(Bucket=self.bucket, Key=self.key(region))
+            return _decode_series(response["Body"].read())
+        except (BotoCoreError, ClientError):
+            return None
+
+    def save(self, region, series, expires_at):
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        try:
+            self._s3().put_object(
+                Bucket=self.bucket, Key=self.key(region), Body=_encode_series(series, expires_at)
+            )
+        except (BotoCoreError, ClientError):
+            pass
+
+
+def _load_stored(region):
+    """Return (series, expires_at) of `region` from the price store, in the
+    region's time zone, or None."""
+    stored = _price_store().load(region)
+    if stored is None:
+        return None
+    return _localize(stored[0], region), stored[1]
+
+
+def _price_store():
+    """Return the store configured by PRICE_STORE, created on first use."""
+    spec = PRICE_STORE
+    if _PRICE_STORE_INSTANCE["spec"] != spec:
+        if spec == "file":
+            store = FilePriceStore()
+        elif spec.startswith("sqlite:"):
+            store = SQLitePriceStore(spec[len("sqlite:"):])
+        elif spec.startswith("s3://"):
+            bucket, _, prefix = spec[len("s3://"):].partition("/")
+            store = S3PriceStore(bucket, prefix or PRICE_STORE_KEY)
+        else:
+            raise ValueError(f"Unsupported PRICE_STORE: {spec!r}")
+        _PRICE_STORE_INSTANCE["spec"], _PRICE_STORE_INSTANCE["store"] = spec, store
+    return _PRICE_STORE_INSTANCE["store"]
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one execution.
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight wait for it and receive the same result, or the same
+    exception re-raised.
+    """
+
+    class _Call:
+        __slots__ = ("done", "result", "error")
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, timeout=None):
+        """Return fn() for the in-flight call of `key`, running it if there
+        is none. Waiters give up with TimeoutError after `timeout` seconds;
+        the call itself carries on for the others."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as exc:
+                call.error = exc
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result
+
+        if not call.done.wait(timeout):
+            raise TimeoutError(f"in-flight call for {key!r} did not finish in time")
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
+
+
+# Concurrent cache misses in one process (threaded hosts, the background
+# refresher) share a single refresh instead of each calling the API.
+_PRICE_FLIGHTS = SingleFlight()
+
+
+def _covers_now(series, now):
+    """Return True if `series` contains the slot the current time falls in."""
+    ts = now.timestamp()
+    return series.timestamps[0] <= ts < series.timestamps[-1] + series.slot_seconds()
+
+
+def _refresh_price_cache(now, check_store=True, allow_upstream=True):
+    """Bring the current region's memory cache up to date.
+
+    Unexpired prices in the shared store are used as they are (another
+    container or the scheduled refresher fetched them). Otherwise, if
+    `allow_upstream`, a fresh series is downloaded and written back to the
+    store. Concurrent callers share one refresh and its result; a caller
+    waits at most until its own request deadline.
+
+    Returns (series, error_message)."""
+    deadline = _REQUEST_DEADLINE.get()
+    region = _current_region()
+    try:
+        return _PRICE_FLIGHTS.do(
+            ("prices", region, allow_upstream),
+            lambda: _refresh_price_cache_once(now, region, check_store, allow_upstream),
+            timeout=deadline.remaining() if deadline is not None else None,
+        )
+    except TimeoutError:
+        return None, TIMEOUT_MESSAGE
+
+
+def _refresh_price_cache_once(now, region, check_store, allow_upstream):
+    cache = _price_cache(region)
+    # Another flight may have finished between the caller's cache check and
+    # this one starting.
+    if cache["entries"] is not None and now.timestamp() < cache["expires_at"]:
+        return cache["entries"], None
+
+    if check_store:
+        stored = _load_stored(region)
+        if stored is not None and now.timestamp() < stored[1]:
+            cache["entries"], cache["expires_at"] = stored
+            return stored[0], None
+    if not allow_upstream:
+        # Until the refresher publishes newer prices, expired ones that still
+        # cover the current slot are the best there is.
+        cached = cache["entries"]
+        if cached is not None and _covers_now(cached, now):
+            return cached, None
+        return None, "I'm sorry, I couldn't find any electricity price data right now."
+
+    series, error = _download_price_entries()
+    if error:
+        # Expired prices that still cover the current slot beat an apology,
+        # whether the API just failed or the circuit is open.
+        cached = cache["entries"]
+        if cached is not None and _covers_now(cached, now):
+            return cached, None
+        return None, error
+
+    expires_at = _price_cache_expiry(series, now)
+    cache["entries"] = series
+    cache["expires_at"] = expires_at
+    _price_store().save(region, series, expires_at)
+    return series, None
+
+
+def _refresh_in_background():
+    """Start a background refresh of the current region unless one is
+    already running."""
+    region = _current_region()
+    lock = _refresh_lock(region)
+    if not lock.acquire(blocking=False):
+        return
+
+    def run():
+        _REQUEST_REGION.set(region)
+        try:
+            _refresh_price_cache(
+                datetime.now(timezone.utc), allow_upstream=not PRICE_STORE_REFRESHER_ONLY
+            )
+        finally:
+            lock.release()
+
+    # On Lambda the thread is frozen together with the container after the
+    # response is sent and simply carries on during the next invocation.
+    threading.Thread(target=run, name="price-refresh", daemon=True).start()
+
+
 def _fetch_all_price_entries():
-    """Fetch all available hourly entries from the API sorted by timestamp.
+    """Return all available price entries of the current region as a
+    PriceSeries.
+
+    Entries are served from the module-level cache while it is valid, then
+    from the price store (see PRICE_STORE), and only downloaded from the API
+    when both have expired. With STALE_WHILE_REVALIDATE, expired entries that
+    still cover the current hour are returned immediately and refreshed in
+    the background, so only the very first fetch waits on the API.
 
     Returns (entries, error_message)."""
-    url = "https://api.spot-hinta.fi/TodayAndDayForward"
-    params = {"priceResolution": 60, "region": "FI"}
+    now = datetime.now(timezone.utc)
+    cache = _price_cache()
+    checked_store = False
+    if cache["entries"] is None:
+        stored = _load_stored(_current_region())
+        checked_store = True
+        if stored is not None and (STALE_WHILE_REVALIDATE or now.timestamp() < stored[1]):
+            cache["entries"], cache["expires_at"] = stored
+
+    cached = cache["entries"]
+    if cached is not None:
+        if now.timestamp() < cache["expires_at"]:
+            return cached, None
+        if STALE_WHILE_REVALIDATE and _covers_now(cached, now):
+            _refresh_in_background()
+            return cached, None
+
+    # With PRICE_STORE_REFRESHER_ONLY, prices still usable for this slot are
+    # only refreshed from the store; the API is for containers without any.
+    usable = cached is not None and _covers_now(cached, now)
+    return _refresh_price_cache(
+        now,
+        check_store=not checked_store,
+        allow_upstream=not (PRICE_STORE_REFRESHER_ONLY and usable),
+    )
 
+
+def _call_in_region(region, fn):
+    """Call `fn()` with `region` as the current region."""
+    token = _REQUEST_REGION.set(region)
     try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        return fn()
+    finally:
+        _REQUEST_REGION.reset(token)
 
-        if not isinstance(data, list) or len(data) == 0:
-            return None, "I'm sorry, I couldn't find any electricity price data right now."
 
-        entries = []
-        for item in data:
-            dt = _parse_iso_datetime(item.get('DateTime'))
-            price = item.get('PriceWithTax')
-            if dt is not None and price is not None:
-                entries.append({"dt": dt, "price": price})
+async def _gather_threads(calls, timeout=None, pending=None):
+    """Run the blocking `calls` (functions without arguments) at the same
+    time, one worker thread each, and return their results in order.
 
-        if not entries:
-            return None, "I'm sorry, I couldn't parse the electricity price data."
+    Each call runs in a copy of the caller's context, so it sees the current
+    region and request deadline. A call still running when `timeout` seconds
+    have passed contributes `pending` instead; its thread carries on (e.g.
+    to finish filling the price cache) and its result is dropped.
 
-        entries.sort(key=lambda x: x['dt'])
+    asyncio is imported here rather than at module load to keep it out of
+    the cold start."""
+    if not calls:
+        return []
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
 
-        return entries, None
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=len(calls), thread_name_prefix="fetch")
+    try:
+        futures = [loop.run_in_executor(pool, contextvars.copy_context().run, call) for call in calls]
+        done, _ = await asyncio.wait(futures, timeout=timeout)
+    finally:
+        pool.shutdown(wait=False)
+    return [future.result() if future in done else pending for future in futures]
+
+
+async def fetch_regions(regions):
+    """Return {region: (series, error_message)} for `regions`, fetched
+    concurrently.
+
+    Each region goes through the usual memory cache, price store and API
+    path (see _fetch_all_price_entries()). All of them share the current
+    request deadline, so the whole batch takes as long as its slowest region
+    and never longer than the deadline; a region still waiting then gets
+    TIMEOUT_MESSAGE."""
+    deadline = _REQUEST_DEADLINE.get()
+    results = await _gather_threads(
+        [lambda region=region: _call_in_region(region, _fetch_all_price_entries) for region in regions],
+        timeout=deadline.remaining() if deadline is not None else None,
+        pending=(None, TIMEOUT_MESSAGE),
+    )
+    return dict(zip(regions, results))
+
+
+def _import_requests():
+    """Import requests on first use.
+
+    Not imported at module load: requests pulls in urllib3, ssl and
+    http.client, which make up most of the cold start import time, and a
+    container served from the price cache never needs them."""
+    with _startup_stage("import_requests"):
+        import requests
+    return requests
+
+
+def _get_http_session():
+    """Return the container-wide keep-alive session used for API calls."""
+    global _HTTP_SESSION
+    if _HTTP_SESSION is None:
+        with _HTTP_SESSION_LOCK:
+            if _HTTP_SESSION is None:
+                requests = _import_requests()
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    # The price API and, with REGION_FROM_DEVICE, the Alexa
+                    # settings API: neither evicts the other's connections.
+                    pool_connections=2,
+                    # The warmup fetches every region at once.
+                    pool_maxsize=max(HTTP_POOL_MAXSIZE, len(PRICE_REGIONS)),
+                    max_retries=0,
+                )
+                session.mount("https://", adapter)
+                session.headers["Connection"] = "keep-alive"
+                session.headers["Accept-Encoding"] = _accept_encoding()
+                _HTTP_SESSION = session
+    return _HTTP_SESSION
+
+
+def _codec(name):
+    """Return the decompression module for content coding `name` ("br" or
+    "zstd"), or None if it isn't installed."""
+    if name not in _CODECS:
+        module = None
+        candidates = {"br": ("brotli", "brotlicffi"), "zstd": ("zstandard",)}[name]
+        for module_name in candidates:
+            try:
+                module = __import__(module_name)
+                break
+            except ImportError:
+                continue
+        _CODECS[name] = module
+    return _CODECS[name]
+
+
+def _accept_encoding():
+    """Return the Accept-Encoding header for API requests (see
+    HTTP_COMPRESSION)."""
+    if HTTP_COMPRESSION != "auto":
+        return ", ".join(c.strip() for c in HTTP_COMPRESSION.split(","))
+    codings = [name for name in ("zstd", "br") if _codec(name) is not None]
+    codings.append("gzip")
+    return ", ".join(codings)
+
+
+def _decode_content(data, content_encoding):
+    """Undo the Content-Encoding of a response body.
+
+    Raises ValueError for unsupported codings or corrupt data."""
+    # Codings are listed in the order they were applied.
+    codings = [c.strip().lower() for c in (content_encoding or "").split(",") if c.strip()]
+    for coding in reversed(codings):
+        try:
+            if coding in ("gzip", "x-gzip"):
+                import gzip
+
+                data = gzip.decompress(data)
+            elif coding == "deflate":
+                import zlib
+
+                try:
+                    data = zlib.decompress(data)
+                except zlib.error:
+                    # Some servers send a raw deflate stream without the
+                    # zlib header.
+                    data = zlib.decompress(data, -zlib.MAX_WBITS)
+            elif coding in ("br", "zstd") and _codec(coding) is not None:
+                if coding == "br":
+                    data = _codec("br").decompress(data)
+                else:
+                    # decompressobj copes with frames that don't record
+                    # their content size.
+                    data = _codec("zstd").ZstdDecompressor().decompressobj().decompress(data)
+            elif coding != "identity":
+                raise ValueError(f"unsupported content coding {coding!r}")
+        except ValueError:
+            raise
+        except Exception as exc:
+            raise ValueError(f"corrupt {coding} body") from exc
+    return data
+
+
+class _StreamDecoder:
+    """Incremental counterpart of _decode_content() for a single coding."""
+
+    def __init__(self, coding):
+        if coding in ("gzip", "x-gzip"):
+            import zlib
+
+            self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif coding == "br":
+            self._obj = _codec("br").Decompressor()
+        elif coding == "zstd":
+            self._obj = _codec("zstd").ZstdDecompressor().decompressobj()
+        else:
+            self._obj = None
+        self.coding = coding
+
+    @classmethod
+    def for_encoding(cls, content_encoding):
+        """Return a decoder for `content_encoding`, or None if the body can
+        only be decoded whole (stacked codings, deflate, unknown codecs)."""
+        codings = [c.strip().lower() for c in (content_encoding or "").split(",") if c.strip()]
+        if not codings:
+            return cls("identity")
+        coding = codings[0]
+        if len(codings) == 1 and (
+            coding in ("identity", "gzip", "x-gzip")
+            or (coding in ("br", "zstd") and _codec(coding) is not None)
+        ):
+            return cls(coding)
+        return None
 
+    def decompress(self, chunk):
+        if self._obj is None:
+            return chunk
+        try:
+            # Brotli's decompressor calls it process(); the others decompress().
+            process = getattr(self._obj, "process", None) or self._obj.decompress
+            return process(chunk)
+        except Exception as exc:
+            raise ValueError(f"corrupt {self.coding} body") from exc
+
+    def finish(self):
+        """Raise ValueError if the compressed stream was cut short."""
+        obj = self._obj
+        if obj is None:
+            return
+        if hasattr(obj, "is_finished"):
+            finished = obj.is_finished()
+        else:
+            finished = getattr(obj, "eof", True)
+        if not finished:
+            raise ValueError(f"truncated {self.coding} body")
+
+
+def _read_body(response, sink=None, cancelled=None):
+    """Read a streamed response body and decode it.
+
+    The body is read undecoded, so the transfer metrics see the bytes that
+    actually crossed the network, and decoded here, so codings the HTTP
+    library doesn't know about (zstd on older urllib3) work too. Decoded
+    chunks are passed to `sink` as they arrive. Reading stops with
+    _Cancelled once the `cancelled` event is set. Returns the decoded
+    body."""
+    requests = _import_requests()
+    from urllib3.exceptions import HTTPError, ReadTimeoutError
+
+    content_encoding = response.headers.get("Content-Encoding")
+    decoder = _StreamDecoder.for_encoding(content_encoding)
+    chunks = []
+    wire_bytes = 0
+    decode_seconds = 0.0
+
+    # Reading the raw stream bypasses requests' own error translation.
+    try:
+        for chunk in response.raw.stream(BODY_CHUNK_BYTES, decode_content=False):
+            if cancelled is not None and cancelled.is_set():
+                raise _Cancelled()
+            wire_bytes += len(chunk)
+            if decoder is None:
+                chunks.append(chunk)
+                continue
+            started = time.perf_counter()
+            data = decoder.decompress(chunk)
+            decode_seconds += time.perf_counter() - started
+            if data:
+                chunks.append(data)
+                if sink is not None:
+                    sink(data)
+    except ReadTimeoutError as exc:
+        raise requests.exceptions.ReadTimeout(exc) from exc
+    except HTTPError as exc:
+        raise requests.exceptions.ConnectionError(exc) from exc
+
+    started = time.perf_counter()
+    if decoder is None:
+        body = _decode_content(b"".join(chunks), content_encoding)
+    else:
+        decoder.finish()
+        body = b"".join(chunks)
+    decode_seconds += time.perf_counter() - started
+    if decoder is None and sink is not None:
+        sink(body)
+    decode_ms = decode_seconds * 1000
+
+    _TRANSFER_STATS["responses"] += 1
+    _TRANSFER_STATS["wire_bytes"] += wire_bytes
+    _TRANSFER_STATS["decoded_bytes"] += len(body)
+    _TRANSFER_STATS["decode_ms"] += decode_ms
+    if HTTP_TRANSFER_METRICS:
+        import json
+
+        print(json.dumps({"http_transfer": {
+            "content_encoding": content_encoding or "identity",
+            "wire_bytes": wire_bytes,
+            "decoded_bytes": len(body),
+            "decode_ms": round(decode_ms, 3),
+        }}))
+    return body
+
+
+class _Cancelled(Exception):
+    """Raised in a hedged API call once the other one has completed."""
+
+
+def _fetch_attempt(url, params, headers, timeout, cancelled=None):
+    """Make one price API call and read its body.
+
+    Returns (response, body, columns): for a 2xx response the decoded body
+    and the price columns scanned out of it as it streamed in (None for an
+    unexpected shape), otherwise None and None. The response is closed,
+    which hands a fully read connection back to the pool; a call cancelled
+    through `cancelled` raises _Cancelled and drops its connection."""
+    started = time.monotonic()
+    response = _get_http_session().get(url, params=params, timeout=timeout, headers=headers, stream=True)
+    try:
+        if cancelled is not None and cancelled.is_set():
+            raise _Cancelled()
+        body = columns = None
+        if 200 <= response.status_code < 300:
+            # The two columns we need are picked out while the body streams
+            # in; json.loads is only the fallback for unexpected shapes.
+            scanner = _PriceColumnScanner()
+            body = _read_body(response, scanner.feed, cancelled)
+            columns = scanner.columns()
+        _FETCH_LATENCIES.append(time.monotonic() - started)
+        return response, body, columns
+    finally:
+        response.close()
+
+
+def _hedge_delay():
+    """Seconds to wait for an API call before hedging it."""
+    samples = sorted(_FETCH_LATENCIES)
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DELAY_MS / 1000
+    rank = min(int(len(samples) * HEDGE_PERCENTILE / 100), len(samples) - 1)
+    return samples[rank]
+
+
+def _hedged_fetch(url, params, headers, timeout, limiter):
+    """_fetch_attempt(), with a second request sent after _hedge_delay() if
+    the first hasn't completed by then.
+
+    The first attempt to complete successfully is returned and the other is
+    cancelled. An attempt that fails leaves the other one running; only when
+    every attempt sent has failed is the first error raised."""
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    _HEDGE_STATS["calls"] += 1
+    delay = _hedge_delay()
+    cancelled = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="hedge")
+    try:
+        primary = pool.submit(_fetch_attempt, url, params, headers, timeout, cancelled)
+        pending = {primary}
+        # A hedge needs time left to complete and a rate limit token.
+        if delay < timeout - MIN_FETCH_TIMEOUT_SECONDS:
+            done, _ = wait(pending, timeout=delay)
+            if not done and limiter.acquire(0):
+                _HEDGE_STATS["fired"] += 1
+                pending.add(pool.submit(_fetch_attempt, url, params, headers, timeout - delay, cancelled))
+
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        _HEDGE_STATS["won"] += 1
+                    return future.result()
+                error = error or future.exception()
+        raise error
+    finally:
+        # The loser stops at its next chunk; requests can't interrupt a read
+        # already waiting on the socket.
+        cancelled.set()
+        pool.shutdown(wait=False)
+        if HTTP_TRANSFER_METRICS:
+            import json
+
+            print(json.dumps({"http_hedge": dict(_HEDGE_STATS, delay_ms=round(delay * 1000, 3))}))
+
+
+def _prewarm_http_connection():
+    """Open a pooled connection to the API ahead of the first fetch."""
+    requests = _import_requests()
+
+    try:
+        _get_http_session().head(SPOT_HINTA_BASE_URL, timeout=2)
     except requests.exceptions.RequestException:
-        return None, "I'm sorry, I couldn't retrieve the electricity price at this moment. Please try again later."
+        pass
+
+
+def _download_price_entries():
+    """Fetch all available price entries of the current region from the API
+    as a PriceSeries.
+
+    The cached series, if any, is revalidated with its ETag/Last-Modified;
+    when the API answers 304 Not Modified that same series is returned.
+
+    Returns (series, error_message)."""
+    requests = _import_requests()
+
+    region = _current_region()
+    url = f"{SPOT_HINTA_BASE_URL}/TodayAndDayForward"
+    params = {"priceResolution": PRICE_RESOLUTION_MINUTES, "region": region}
+
+    timeout = _fetch_timeout()
+    if timeout is None:
+        return None, TIMEOUT_MESSAGE
+
+    breaker = _upstream_breaker(region)
+    if not breaker.allow():
+        return None, breaker.last_error or UNAVAILABLE_MESSAGE
+
+    # Wait for the rate limit only as long as the request budget allows;
+    # past that the caller is better off with cached prices or an apology.
+    limiter = _upstream_limiter()
+    started = time.monotonic()
+    if not limiter.acquire(timeout - MIN_FETCH_TIMEOUT_SECONDS):
+        breaker.release()
+        return None, UNAVAILABLE_MESSAGE
+    timeout -= time.monotonic() - started
+
+    # Revalidate what we already hold: an unchanged series costs a 304
+    # without a body to transfer or parse.
+    cached = _price_cache(region)["entries"]
+    headers = {}
+    if cached is not None and cached.validators:
+        if cached.validators.get("etag"):
+            headers["If-None-Match"] = cached.validators["etag"]
+        if cached.validators.get("last_modified"):
+            headers["If-Modified-Since"] = cached.validators["last_modified"]
+
+    # What the breaker records for this call: a failure with this message
+    # unless the API is seen to answer. Settled in the finally clause, so no
+    # way out (including an unexpected exception) leaves a half-open probe
+    # hanging.
+    failure = UNAVAILABLE_MESSAGE
+    trip = False
+    try:
+        with _startup_stage("first_fetch"):
+            # The whole first fetch: request, body read and decode, parse.
+            if HEDGE_REQUESTS:
+                response, body, columns = _hedged_fetch(url, params, headers, timeout, limiter)
+            else:
+                response, body, columns = _fetch_attempt(url, params, headers, timeout)
+            if response.status_code == 304 and cached is not None:
+                failure = None
+                return cached, None
+            if response.status_code == 429:
+                retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+                if retry_after is not None:
+                    limiter.defer(retry_after)
+                trip = True
+                return None, UNAVAILABLE_MESSAGE
+            response.raise_for_status()
+            try:
+                if columns is not None:
+                    series = _series_from_columns(*columns)
+                else:
+                    import json
+
+                    data = json.loads(body)
+                    if not isinstance(data, list) or len(data) == 0:
+                        failure = None
+                        return None, "I'm sorry, I couldn't find any electricity price data right now."
+                    series = _series_from_payload(data)
+            except (TypeError, AttributeError):
+                # Valid JSON of the wrong shape: items that aren't objects,
+                # fields of the wrong type, or no body at all.
+                series = None
+            failure = None
+
+        if series is None:
+            return None, "I'm sorry, I couldn't parse the electricity price data."
+        _localize(series, region)
+
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if etag or last_modified:
+            series.validators = {"etag": etag, "last_modified": last_modified}
+        return series, None
+
+    except requests.exceptions.Timeout:
+        failure = TIMEOUT_MESSAGE
+        return None, TIMEOUT_MESSAGE
+    except (requests.exceptions.RequestException, ValueError):
+        # ValueError: a body that doesn't decompress or isn't JSON.
+        return None, UNAVAILABLE_MESSAGE
+    finally:
+        if failure is None:
+            breaker.record_success()
+        else:
+            breaker.record_failure(failure, trip=trip)
 
 
 def _get_price_entries(future_hours=4):
     """Fetch hourly entries and return a list of up to `future_hours` entries
-    starting from the current hour. Returns (entries, error_message)."""
-    entries, error = _fetch_all_price_entries()
+    starting from the current hour. Sub-hourly prices are averaged per hour.
+    Returns (entries, error_message)."""
+    series, error = _load_price_series()
     if error:
         return None, error
+    return _upcoming_hours(series, future_hours)
 
-    sample_tz = entries[0]['dt'].tzinfo or timezone.utc
-    now = datetime.now(timezone.utc).astimezone(sample_tz)
-    hour_start = now.replace(minute=0, second=0, microsecond=0)
 
-    current_index = None
-    for i, e in enumerate(entries):
-        if e['dt'] == hour_start:
-            current_index = i
-            break
-        if e['dt'] > hour_start:
-            current_index = i - 1 if i > 0 else i
-            break
+def _upcoming_hours(series, future_hours):
+    """Return (entries, error_message) with up to `future_hours` hourly
+    entries of `series` starting from the current hour."""
+    series = series.hourly()
 
-    if current_index is None:
-        current_index = len(entries) - 1
+    # Start at the hour containing now; if every hour is in the future, start
+    # at the first one.
+    current_index = max(series.slot_index(datetime.now(timezone.utc).timestamp()), 0)
 
-    desired = []
-    for offset in range(0, future_hours):
-        idx = current_index + offset
-        if 0 <= idx < len(entries):
-            desired.append(entries[idx])
+    desired = series[current_index:current_index + future_hours]
 
     if len(desired) == 0:
         return None, "I'm sorry, I couldn't determine the spot prices for the next hours."
@@ -158,10 +2054,17 @@ def get_spot_price_ssml():
 
     Uses short pauses and say-as for numbers to improve clarity.
     """
-    entries, error = _get_price_entries(4)
+    series, error = _load_price_series()
     if error:
         # Wrap error into SSML
         return f"<speak>{error}</speak>"
+    return _cached_answer(series, ("GetSpotPriceIntent",), _spot_price_ssml)
+
+
+def _spot_price_ssml(series):
+    entries, error = _upcoming_hours(series, 4)
+    if error:
+        return f"<speak>{error}</speak>"
 
     def fmt(price_eur):
         return f"{price_eur * 100:.1f}"
@@ -174,7 +2077,7 @@ def get_spot_price_ssml():
     # Build SSML with small breaks and clear number rendering
     parts = []
     # Add a short 100ms break after each announced clause to separate them
-    parts.append(f"The current electricity spot price in Finland is <break time=\"200ms\"/> <say-as interpret-as=\"cardinal\">{curr}</say-as> cents per kilowatt-hour. <break time=\"100ms\"/>")
+    parts.append(f"The current electricity spot price in {_region_name()} is <break time=\"200ms\"/> <say-as interpret-as=\"cardinal\">{curr}</say-as> cents per kilowatt-hour. <break time=\"100ms\"/>")
 
     if next1 is not None:
         parts.append(f"Next hour <break time=\"150ms\"/> <say-as interpret-as=\"cardinal\">{next1}</say-as> cents <break time=\"100ms\"/>")
@@ -196,62 +2099,62 @@ def _format_hour(dt, tz):
     return localized.strftime("%H:%M")
 
 
+def _remaining_today(series):
+    """Return (now_local, start, end): the local time and the index range of
+    today's slots from the current slot (inclusive) onwards."""
+    now_local = datetime.now(timezone.utc).astimezone(series.tz)
+    slot_start_ts = series.slot_start(now_local.timestamp())
+
+    start, end = series.day_range(now_local.date())
+    return now_local, series.first_index_from(slot_start_ts, start, end), end
+
+
+def _cheapest_index(series, start, end):
+    """Return the index of the lowest price in [start, end)."""
+    return min(range(start, end), key=series.prices.__getitem__)
+
+
 def get_cheapest_price_message():
-    """Return a human-readable description of today's cheapest hour."""
-    entries, error = _fetch_all_price_entries()
+    """Return a human-readable description of today's cheapest slot."""
+    series, error = _load_price_series()
     if error:
         return error
 
-    sample_tz = entries[0]['dt'].tzinfo or timezone.utc
-    now_local = datetime.now(timezone.utc).astimezone(sample_tz)
-    today = now_local.date()
-
-    # Consider only remaining hours starting from the current hour (inclusive).
-    hour_start = now_local.replace(minute=0, second=0, microsecond=0)
-    todays_entries = [
-        e for e in entries
-        if e['dt'].astimezone(sample_tz).date() == today
-        and e['dt'].astimezone(sample_tz) >= hour_start
-    ]
-    if not todays_entries:
+    # Consider only remaining slots starting from the current one (inclusive).
+    _, start, end = _remaining_today(series)
+    if start == end:
         return "I'm sorry, I couldn't find any remaining electricity price entries for today."
 
-    cheapest_entry = min(todays_entries, key=lambda e: e['price'])
-    cheapest_price = f"{cheapest_entry['price'] * 100:.1f}"
-    cheapest_time = _format_hour(cheapest_entry['dt'], sample_tz)
+    cheapest = _cheapest_index(series, start, end)
+    cheapest_price = f"{series.prices[cheapest] * 100:.1f}"
+    cheapest_time = _format_hour(series.dt(cheapest), series.tz)
 
     return (
-        "The lowest electricity spot price in Finland today is "
+        f"The lowest electricity spot price in {_region_name()} today is "
         f"{cheapest_price} cents per kilowatt-hour at {cheapest_time}."
     )
 
 
 def get_cheapest_price_ssml():
-    """Return SSML describing the cheapest hour for the current day."""
-    entries, error = _fetch_all_price_entries()
+    """Return SSML describing the cheapest slot for the current day."""
+    series, error = _load_price_series()
     if error:
         return f"<speak>{error}</speak>"
+    return _cached_answer(series, ("CheapestPriceIntent",), _cheapest_price_ssml)
 
-    sample_tz = entries[0]['dt'].tzinfo or timezone.utc
-    now_local = datetime.now(timezone.utc).astimezone(sample_tz)
-    today = now_local.date()
 
-    # Consider only remaining hours starting from the current hour (inclusive).
-    hour_start = now_local.replace(minute=0, second=0, microsecond=0)
-    todays_entries = [
-        e for e in entries
-        if e['dt'].astimezone(sample_tz).date() == today
-        and e['dt'].astimezone(sample_tz) >= hour_start
-    ]
-    if not todays_entries:
+def _cheapest_price_ssml(series):
+    # Consider only remaining slots starting from the current one (inclusive).
+    _, start, end = _remaining_today(series)
+    if start == end:
         return "<speak>I'm sorry, I couldn't find any remaining electricity price entries for today.</speak>"
 
-    cheapest_entry = min(todays_entries, key=lambda e: e['price'])
-    cheapest_time = _format_hour(cheapest_entry['dt'], sample_tz)
-    cheapest_price = f"{cheapest_entry['price'] * 100:.1f}"
+    cheapest = _cheapest_index(series, start, end)
+    cheapest_time = _format_hour(series.dt(cheapest), series.tz)
+    cheapest_price = f"{series.prices[cheapest] * 100:.1f}"
 
     ssml_body = (
-        "The lowest electricity spot price in Finland today is "
+        f"The lowest electricity spot price in {_region_name()} today is "
         f"<say-as interpret-as=\"cardinal\">{cheapest_price}</say-as> cents per kilowatt-hour "
         f"at <say-as interpret-as=\"time\">{cheapest_time}</say-as>."
     )
@@ -259,99 +2162,154 @@ def get_cheapest_price_ssml():
     return f"<speak>{ssml_body}</speak>"
 
 
-def get_run_machine_ssml():
+def _duration_phrase(minutes):
+    """Spoken adjective for a run length, e.g. "three-hour" or "90-minute"."""
+    hours, rest = divmod(minutes, 60)
+    if rest == 0 and hours < len(_NUMBER_WORDS):
+        return f"{_NUMBER_WORDS[hours]}-hour"
+    return f"{minutes}-minute"
+
+
+def get_run_machine_ssml(duration_minutes=None, threshold_cents=None):
     """Return SSML advising whether to run a machine now.
 
-    - If the current hour and the next two hours all have spot prices below 7 cents,
-      return: "Yes, now is a good time.".
-    - Otherwise, find the start time today (from now until 23:59) of the 3-hour
-      contiguous window with the lowest combined price and return:
+    A run of `duration_minutes` (default RUN_MACHINE_DURATION_MINUTES) is
+    good when every slot it covers costs at most `threshold_cents` (default
+    RUN_MACHINE_THRESHOLD_CENTS). Runs starting today may continue past
+    midnight into tomorrow's prices once those are published.
+
+    - If a run starting now qualifies, return: "Yes, now is a good time.".
+    - Otherwise recommend the earliest qualifying start later today:
       "No, run it at TIME" (TIME is formatted as HH:MM).
+    - From PRICES_PUBLISHED_HOUR on, with tomorrow's prices published and
+      nothing qualifying today, list up to three qualifying starts tomorrow,
+      or say there are no good times today or tomorrow.
+    - Otherwise recommend the start of the cheapest run remaining today.
     """
-    entries, error = _fetch_all_price_entries()
+    if duration_minutes is None:
+        duration_minutes = RUN_MACHINE_DURATION_MINUTES
+    if threshold_cents is None:
+        threshold_cents = RUN_MACHINE_THRESHOLD_CENTS
+
+    if not MIN_RUN_DURATION_MINUTES <= duration_minutes <= MAX_RUN_DURATION_MINUTES:
+        return "<speak>I can plan runs between fifteen minutes and twelve hours.</speak>"
+
+    series, error = _load_price_series()
     if error:
         return f"<speak>{error}</speak>"
+    return _cached_answer(
+        series,
+        ("ShouldIRunMachineIntent", duration_minutes, threshold_cents),
+        lambda s: _run_machine_ssml(s, duration_minutes, threshold_cents),
+    )
 
-    sample_tz = entries[0]['dt'].tzinfo or timezone.utc
-    now_local = datetime.now(timezone.utc).astimezone(sample_tz)
-    hour_start = now_local.replace(minute=0, second=0, microsecond=0)
 
-    # Remaining entries for today starting from the current hour (inclusive).
-    todays_entries = [
-        e for e in entries
-        if e['dt'].astimezone(sample_tz).date() == now_local.date()
-        and e['dt'].astimezone(sample_tz) >= hour_start
-    ]
+def _run_machine_ssml(series, duration_minutes, threshold_cents):
+    # Remaining entries for today starting from the current slot (inclusive).
+    now_local, start, end = _remaining_today(series)
 
-    if not todays_entries:
+    if start == end:
         return "<speak>I'm sorry, I couldn't find any remaining electricity price entries for today.</speak>"
 
-    # If we have at least current + next 2 hours, check immediate threshold (7 cents = 0.07 EUR)
-    if len(todays_entries) >= 3:
-        first_three = todays_entries[:3]
-        if all((e['price'] * 100) < 7.0 for e in first_three):
-            return "<speak>Yes, now is a good time.</speak>"
-
-    # Find any remaining 3-hour windows today where each hour is <= 7 cents.
-    today_windows = []
-    if len(todays_entries) >= 3:
-        for i in range(0, len(todays_entries) - 2):
-            window = todays_entries[i:i+3]
-            if all((e['price'] * 100) <= 7.0 for e in window):
-                today_windows.append(i)
-
-    if today_windows:
-        # Recommend the earliest qualifying window today.
-        start_dt = todays_entries[today_windows[0]]['dt']
-        start_time_str = _format_hour(start_dt, sample_tz)
+    # Number of slots the run occupies, rounding partial slots up.
+    slot_minutes = series.slot_seconds() // 60
+    k = max(-(-duration_minutes // slot_minutes), 1)
+
+    # Search today and, if already published and adjacent, tomorrow in a
+    # single pass so runs may cross midnight.
+    tomorrow_date = (now_local + timedelta(days=1)).date()
+    t_start, t_end = series.day_range(tomorrow_date)
+    has_tomorrow = t_start < t_end
+    horizon = t_end if has_tomorrow and series.is_contiguous(start, t_end) else end
+    windows = PriceWindows(series.prices, start, horizon, k)
+
+    # Can we start right now?
+    if windows and (windows.max_at(start) * 100) <= threshold_cents:
+        return "<speak>Yes, now is a good time.</speak>"
+
+    # Recommend the earliest qualifying run starting later today.
+    earliest = windows.earliest_at_most_cents(threshold_cents, hi=end)
+    if earliest is not None:
+        start_time_str = _format_hour(series.dt(earliest), series.tz)
         return f"<speak>No, run it at <say-as interpret-as=\"time\">{start_time_str}</say-as>.</speak>"
 
-    # If no qualifying 3-hour window today, and it's 14:00 or later, consult tomorrow's published prices
-    if now_local.hour >= 14:
-        from datetime import timedelta
-
-        tomorrow_date = (now_local + timedelta(days=1)).date()
-        tomorrow_entries = [
-            e for e in entries
-            if e['dt'].astimezone(sample_tz).date() == tomorrow_date
-        ]
-
-        tomorrow_windows = []
-        if len(tomorrow_entries) >= 3:
-            for i in range(0, len(tomorrow_entries) - 2):
-                window = tomorrow_entries[i:i+3]
-                if all((e['price'] * 100) <= 7.0 for e in window):
-                    tomorrow_windows.append(tomorrow_entries[i]['dt'])
+    # If nothing qualifies today, and tomorrow's prices are out, consult them.
+    if now_local.hour >= PRICES_PUBLISHED_HOUR and has_tomorrow:
+        if horizon != t_end:
+            windows = PriceWindows(series.prices, t_start, t_end, k)
+        tomorrow_windows = windows.at_most_cents(threshold_cents, lo=t_start, hi=t_end)
 
         if tomorrow_windows:
             # Build a list of up to 3 start times and wrap each in say-as time
-            times = [_format_hour(dt, sample_tz) for dt in tomorrow_windows[:3]]
+            times = [_format_hour(series.dt(i), series.tz) for i in tomorrow_windows[:3]]
             wrapped = " or then at ".join([f'<say-as interpret-as="time">{t}</say-as>' for t in times])
             return f"<speak>Today is not a good time. Tomorrow run it at {wrapped}.</speak>"
         else:
             # Explicitly inform the user if neither today nor tomorrow has any
-            # qualifying 3-hour windows.
+            # qualifying windows.
             return "<speak>No good times today or tomorrow.</speak>"
 
-    # Fallback: find the cheapest contiguous 3-hour window remaining today (by sum)
-    if len(todays_entries) < 3:
-        return "<speak>I'm sorry, I couldn't find a three-hour window remaining today.</speak>"
-
-    best_idx = None
-    best_sum = None
-    for i in range(0, len(todays_entries) - 2):
-        window = todays_entries[i:i+3]
-        s = sum(e['price'] for e in window)
-        if best_sum is None or s < best_sum:
-            best_sum = s
-            best_idx = i
+    # Fallback: the cheapest run (by total) starting today.
+    best_idx = windows.cheapest(hi=end)
+    if best_idx is None:
+        phrase = _duration_phrase(duration_minutes)
+        return f"<speak>I'm sorry, I couldn't find a {phrase} window remaining today.</speak>"
 
-    start_dt = todays_entries[best_idx]['dt']
-    start_time_str = _format_hour(start_dt, sample_tz)
+    start_time_str = _format_hour(series.dt(best_idx), series.tz)
 
     return f"<speak>No, run it at <say-as interpret-as=\"time\">{start_time_str}</say-as>.</speak>"
 
 
+def _slot_value(intent, name):
+    """Return the raw value of slot `name` of `intent`, or None."""
+    slot = (intent.get("slots") or {}).get(name) or {}
+    return slot.get("value")
+
+
+def _parse_duration_minutes(value):
+    """Parse an AMAZON.DURATION value (or a plain number of hours) into
+    minutes. Returns None if the value can't be understood."""
+    if not value:
+        return None
+    match = _ISO_DURATION_RE.match(value)
+    if match:
+        days, hours, minutes, seconds = (int(g) if g else 0 for g in match.groups())
+        total = days * 1440 + hours * 60 + minutes + (1 if seconds else 0)
+        return total or None
+    try:
+        minutes = float(value) * 60
+    except ValueError:
+        return None
+    # Also rejects "inf", "nan" and values that overflow to infinity.
+    if not 0 < minutes < float("inf"):
+        return None
+    return round(minutes) or None
+
+
+def _parse_threshold_cents(value):
+    """Parse a threshold slot value into cents; None (the default applies)
+    unless it is a finite number. Zero and negative thresholds are kept:
+    spot prices do go that low."""
+    if value is None:
+        return None
+    try:
+        cents = float(value)
+    except ValueError:
+        return None
+    if not -float("inf") < cents < float("inf"):
+        return None
+    return cents
+
+
+def _run_machine_options(intent):
+    """Read the optional `duration` and `threshold` (cents) slots of a
+    ShouldIRunMachineIntent as keyword arguments for get_run_machine_ssml()."""
+    return {
+        "duration_minutes": _parse_duration_minutes(_slot_value(intent, "duration")),
+        "threshold_cents": _parse_threshold_cents(_slot_value(intent, "threshold")),
+    }
+
+
 def _build_ssml_response(ssml, should_end_session=False, reprompt_ssml="<speak>Still Listening.</speak>"):
     response = {
         "outputSpeech": {
@@ -398,12 +2356,184 @@ def _with_closing_cue(ssml):
     return f"<speak>{s} {chosen}</speak>"
 
 
+def _device_region(event):
+    """Return the zone matching the requesting device's time zone setting,
+    or None. Looked up once per device through the Alexa Settings API."""
+    system = ((event or {}).get("context") or {}).get("System") or {}
+    device_id = (system.get("device") or {}).get("deviceId")
+    endpoint = system.get("apiEndpoint")
+    access_token = system.get("apiAccessToken")
+    if not (device_id and endpoint and access_token):
+        return None
+
+    if device_id not in _DEVICE_REGIONS:
+        timeout = _fetch_timeout()
+        if timeout is None:
+            return None
+        requests = _import_requests()
+        try:
+            response = _get_http_session().get(
+                f"{endpoint}/v2/devices/{device_id}/settings/System.timeZone",
+                headers={
+                    "Authorization": f"Bearer {access_token}",
+                    # Left to requests to decode; it can't do zstd.
+                    "Accept-Encoding": "gzip, deflate",
+                },
+                timeout=min(timeout, DEVICE_SETTINGS_TIMEOUT_SECONDS),
+            )
+            response.raise_for_status()
+            timezone_name = response.json()
+        except (requests.exceptions.RequestException, ValueError):
+            # Not remembered, so the next request from the device retries.
+            return None
+        while len(_DEVICE_REGIONS) >= DEVICE_REGIONS_MAX:
+            # Forget the device looked up longest ago.
+            _DEVICE_REGIONS.pop(next(iter(_DEVICE_REGIONS)), None)
+        _DEVICE_REGIONS[device_id] = _TIMEZONE_REGIONS.get(timezone_name)
+    return _DEVICE_REGIONS.get(device_id)
+
+
+def _is_warmup_event(event):
+    """Return True for a scheduled (EventBridge) invocation rather than an
+    Alexa request, e.g. {"source": "aws.events", ...} or {"warmup": true}."""
+    return isinstance(event, dict) and (
+        event.get("source") == "aws.events" or event.get("warmup") is True
+    )
+
+
+def _handle_warmup(context=None):
+    """Refresh the price cache of every region in PRICE_REGIONS, concurrently,
+    and precompute each intent's default answer for the current slot, so the
+    Alexa requests that follow are answered from memory. Returns a small
+    summary per region instead of an Alexa response."""
+    import asyncio
+
+    return asyncio.run(_handle_warmup_async(context))
+
+
+async def _handle_warmup_async(context=None):
+    regions = PRICE_REGIONS or [DEFAULT_REGION]
+    # The regions share what is left of the invocation; no Alexa window
+    # applies to a scheduled event.
+    get_remaining = getattr(context, "get_remaining_time_in_millis", None)
+    deadline = Deadline(max(get_remaining() - RESPONSE_RESERVE_MS, 0)) if get_remaining else None
+    token = _REQUEST_DEADLINE.set(deadline)
+    try:
+        # One pass: each region's fetch waits on the network at the same
+        # time, so the warmup takes as long as the slowest region. Even a
+        # single region runs in a worker thread, keeping the loop free.
+        results = await _gather_threads(
+            [lambda region=region: _warm_region(region) for region in regions],
+            timeout=deadline.remaining() if deadline is not None else None,
+            pending={"ok": False, "error": TIMEOUT_MESSAGE},
+        )
+    finally:
+        _REQUEST_DEADLINE.reset(token)
+
+    summary = dict(zip(regions, results))
+    return {"warmup": {"ok": all(r["ok"] for r in results), "regions": summary}}
+
+
+def _warm_region(region):
+    """Warm the caches of one region; see _handle_warmup()."""
+    token = _REQUEST_REGION.set(region)
+    try:
+        now = datetime.now(timezone.utc)
+        cache = _price_cache(region)
+        series = cache["entries"]
+        error = None
+        if series is None or now.timestamp() >= cache["expires_at"]:
+            # The scheduled warmup is the refresher: it may always call the API.
+            # On failure the refresh already serves cached prices that cover
+            # this slot. Nothing else is tried: another API call would count
+            # against the breaker and the rate limit, and requests read
+            # expired prices from the store themselves.
+            series, error = _refresh_price_cache(now)
+        if error:
+            return {"ok": False, "error": error}
+        if now.timestamp() >= cache["expires_at"]:
+            # The refresh failed but left expired prices covering this slot.
+            # Requests can still use them; precomputing answers here would
+            # start yet another refresh.
+            error = _upstream_breaker(region).last_error or UNAVAILABLE_MESSAGE
+            return {"ok": False, "error": error, "entries": len(series)}
+
+        # Build the derived indexes the intents use.
+        now_local = now.astimezone(series.tz)
+        series.hourly()
+        series.day_range(now_local.date())
+        series.day_range((now_local + timedelta(days=1)).date())
+
+        # Fills the answer cache with each intent's default answer.
+        get_spot_price_ssml()
+        get_cheapest_price_ssml()
+        get_run_machine_ssml()
+
+        answers = _ANSWER_CACHE["regions"].get(region, {}).get("answers", {})
+        return {"ok": True, "entries": len(series), "answers": len(answers)}
+    finally:
+        _REQUEST_REGION.reset(token)
+
+
 def lambda_handler(event, context):
     """Alexa Lambda Function Entry Point"""
 
+    if _is_warmup_event(event):
+        return _handle_warmup(context)
+
+    # Everything below runs against a single request deadline so a slow
+    # upstream yields a spoken apology instead of a timeout on the device.
+    token = _REQUEST_DEADLINE.set(Deadline.from_context(context))
+    # _handle_request() sets the request's region.
+    region_token = _REQUEST_REGION.set(None)
+    try:
+        with _startup_stage("first_invocation"):
+            return _handle_request(event)
+    finally:
+        _REQUEST_REGION.reset(region_token)
+        _REQUEST_DEADLINE.reset(token)
+        _emit_startup_report()
+
+
+# Intents answered without price data.
+_NO_PRICE_INTENTS = {"AMAZON.StopIntent", "AMAZON.CancelIntent"}
+
+
+async def async_lambda_handler(event, context):
+    """Entry point for hosts that run an event loop; same contract as
+    lambda_handler().
+
+    The request itself runs in a worker thread so the loop stays free to
+    serve other requests; a scheduled warmup fetches its regions
+    concurrently on the loop."""
+    if _is_warmup_event(event):
+        return await _handle_warmup_async(context)
+    import asyncio
+
+    return await asyncio.to_thread(lambda_handler, event, context)
+
+
+def _handle_request(event):
     request = (event or {}).get("request", {})
     request_type = request.get("type")
 
+    # The bidding zone to answer for: a "region" slot, else the device's time
+    # zone setting (REGION_FROM_DEVICE), else DEFAULT_REGION.
+    region_value = _slot_value(request.get("intent") or {}, "region")
+    region = _parse_region(region_value)
+    if region_value and region is None:
+        from xml.sax.saxutils import escape
+
+        ssml = f"<speak>I'm sorry, I don't have electricity prices for {escape(region_value)}.</speak>"
+        return _build_ssml_response(_with_closing_cue(ssml))
+    intent_name = (request.get("intent") or {}).get("name")
+    wants_prices = request_type != "LaunchRequest" and intent_name not in _NO_PRICE_INTENTS
+    if region is None and REGION_FROM_DEVICE and wants_prices:
+        # Costs a Settings API call on a device's first request, so only
+        # when prices are going to be looked up.
+        region = _device_region(event)
+    _REQUEST_REGION.set(region)
+
     # 1. Handle LaunchRequest separately
     if request_type == "LaunchRequest":
         welcome_ssml = """
@@ -416,7 +2546,6 @@ def lambda_handler(event, context):
     # 2. Intent requests
     if request_type == "IntentRequest":
         intent = request.get("intent", {})
-        intent_name = intent.get("name")
         # For all Intent invocations (except Stop/Cancel which end the session),
         # append the configured closing cue inside the SSML.
         if intent_name == "CheapestPriceIntent":
@@ -424,7 +2553,7 @@ def lambda_handler(event, context):
             return _build_ssml_response(_with_closing_cue(ssml))
 
         if intent_name == "ShouldIRunMachineIntent":
-            ssml = get_run_machine_ssml()
+            ssml = get_run_machine_ssml(**_run_machine_options(intent))
             return _build_ssml_response(_with_closing_cue(ssml))
 
         if intent_name in {"GetSpotPriceIntent", "AMAZON.FallbackIntent"}:
@@ -432,8 +2561,16 @@ def lambda_handler(event, context):
             return _build_ssml_response(_with_closing_cue(ssml))
 
         # Stop/Cancel should end the session without the closing cue
-        if intent_name in ("AMAZON.StopIntent", "AMAZON.CancelIntent"):
+        if intent_name in _NO_PRICE_INTENTS:
             return _build_ssml_response("<speak>Goodbye.</speak>", should_end_session=True)
 
     # 3. Fallback
     return _build_ssml_response(get_spot_price_ssml())
+
+
+if PREWARM_HTTP_CONNECTION:
+    # Runs during the Lambda init phase, in parallel with the first invocation.
+    threading.Thread(target=_prewarm_http_connection, name="http-prewarm", daemon=True).start()
+
+# Keep last: module init ends here.
+_STARTUP_STATE["module_init_ms"] = round((time.perf_counter() - _MODULE_LOAD_STARTED) * 1000, 3)
@@ -0,0 +1,145 @@
+"""Measure the cold import time of the packaged Lambda function.
+
+Builds the deployment ZIP with ``deploy.sh --build-only`` (unless ``--zip`` is
+given), extracts it to a temporary directory and imports ``lambda_function``
+in fresh interpreters with ``python -X importtime``, the way a new Lambda
+container would. Prints a JSON report with the median and worst cold import
+times and the slowest modules. With ``--max-ms`` it exits non-zero when the
+median exceeds the budget, so it can gate a deployment.
+
+Usage:
+    python3 measure_cold_start.py [--slim] [--zip lambda.zip] [--runs 10] [--max-ms 50]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import zipfile
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# What a cold container imports at init, and what the first real fetch adds.
+COLD_IMPORT = "import lambda_function"
+FIRST_FETCH_IMPORT = "import lambda_function; lambda_function._import_requests()"
+
+
+def parse_importtime(stderr):
+    """Parse ``-X importtime`` output into a list of
+    (module, self_us, cumulative_us) tuples. `module` keeps the indentation
+    importtime uses to show nesting."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            # The header line ("self [us] | cumulative | imported package")
+            continue
+        rows.append((fields[2][1:].rstrip(), int(fields[0]), int(fields[1])))
+    return rows
+
+
+def _top_level_total(rows):
+    """Sum the cumulative time of top-level imports, i.e. the whole
+    import tree below the statement that was run."""
+    return sum(cumulative for module, _, cumulative in rows if not module.startswith(" "))
+
+
+def measure(package_dir, code, runs):
+    """Run `code` in `runs` fresh interpreters inside `package_dir`.
+
+    Returns (totals_ms, rows_of_last_run)."""
+    env = dict(os.environ, PYTHONPATH=package_dir)
+    # Lambda can't write bytecode to /var/task; don't let local runs cache it
+    # either, or every run after the first would look faster than production.
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    totals = []
+    rows = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=package_dir,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        # site and friends are imported before `code` runs and are the same
+        # for every Lambda function; only count what `code` imports.
+        rows = parse_importtime(result.stderr)
+        code_rows = rows[_first_code_import(rows):]
+        totals.append(_top_level_total(code_rows) / 1000)
+    return totals, rows
+
+
+def _first_code_import(rows):
+    """Index of the first row belonging to the imports made by `-c` code,
+    i.e. right after the interpreter's own `site` import tree."""
+    for i, (module, _, _) in enumerate(rows):
+        if module == "site":
+            return i + 1
+    return 0
+
+
+def build_zip(slim):
+    args = [os.path.join(HERE, "deploy.sh"), "--build-only"]
+    if slim:
+        args.append("--slim")
+    subprocess.run(args, cwd=HERE, check=True)
+    return os.path.join(HERE, "lambda.zip")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--zip", help="measure an existing ZIP instead of building one")
+    parser.add_argument("--slim", action="store_true", help="build with deploy.sh --slim")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=10, help="number of slowest modules to list")
+    parser.add_argument("--max-ms", type=float, help="fail if the median cold import exceeds this")
+    args = parser.parse_args(argv)
+
+    zip_path = args.zip or build_zip(args.slim)
+
+    with tempfile.TemporaryDirectory() as package_dir:
+        with zipfile.ZipFile(zip_path) as zf:
+            zf.extractall(package_dir)
+
+        cold, _ = measure(package_dir, COLD_IMPORT, args.runs)
+        first_fetch, rows = measure(package_dir, FIRST_FETCH_IMPORT, args.runs)
+
+    slowest = sorted(rows[_first_code_import(rows):], key=lambda r: r[1], reverse=True)
+    report = {
+        "zip": os.path.relpath(zip_path),
+        "zip_bytes": os.path.getsize(zip_path),
+        "runs": args.runs,
+        "cold_import_ms": {
+            "median": round(statistics.median(cold), 2),
+            "max": round(max(cold), 2),
+        },
+        "cold_import_with_requests_ms": {
+            "median": round(statistics.median(first_fetch), 2),
+            "max": round(max(first_fetch), 2),
+        },
+        "slowest_modules_self_ms": [
+            {"module": module.strip(), "ms": round(self_us / 1000, 2)}
+            for module, self_us, _ in slowest[:args.top]
+        ],
+    }
+    print(json.dumps(report, indent=2))
+
+    if args.max_ms is not None and report["cold_import_ms"]["median"] > args.max_ms:
+        print(
+            f"Cold import median {report['cold_import_ms']['median']} ms exceeds "
+            f"the {args.max_ms} ms budget.",
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
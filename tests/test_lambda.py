@@ -6,6 +6,15 @@ import pytest
 import lambda_function as lf
 
 
+@pytest.fixture(autouse=True)
+def _fresh_upstream_guards(monkeypatch):
+    # Failures and calls recorded by one test must not open the circuit or
+    # drain the rate limit for the next.
+    monkeypatch.setattr(lf, "_UPSTREAM_BREAKERS", {})
+    monkeypatch.setattr(lf, "_UPSTREAM_LIMITER", None)
+    monkeypatch.setattr(lf, "_REFRESH_LOCKS", {})
+
+
 def make_event(request_type, intent_name=None):
     event = {"request": {"type": request_type}}
     if intent_name:
@@ -261,3 +270,1684 @@ def test_should_i_run_machine_after_14_no_good_times(monkeypatch):
     assert "No good times today or tomorrow." in ssml
     assert any(v in ssml for v in lf.CLOSING_CUES)
     assert resp["response"].get("shouldEndSession") is False
+
+
+def _hourly_series(start, count, price=0.05):
+    from datetime import timedelta
+
+    entries = [{"dt": start + timedelta(hours=i), "price": price} for i in range(count)]
+    return lf.PriceSeries.from_entries(entries)
+
+
+def test_price_cache_reuses_entries_across_invocations(monkeypatch, tmp_path):
+    from datetime import datetime, timezone
+
+    hour_start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    entries = _hourly_series(hour_start, 48)
+    calls = []
+
+    def fake_download():
+        calls.append(1)
+        return entries, None
+
+    monkeypatch.setitem(lf._PRICE_CACHES, "FI", {"entries": None, "expires_at": 0.0})
+    monkeypatch.setattr(lf, "PRICE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(lf, "STALE_WHILE_REVALIDATE", False)
+    monkeypatch.setattr(lf, "_download_price_entries", fake_download)
+
+    assert lf._fetch_all_price_entries() == (entries, None)
+    assert lf._fetch_all_price_entries() == (entries, None)
+    assert len(calls) == 1
+
+    # Once both caches have expired the next call goes back to the API.
+    lf._PRICE_CACHES["FI"]["expires_at"] = 0.0
+    (tmp_path / lf.PRICE_CACHE_FILE.format(region="FI")).unlink()
+    lf._fetch_all_price_entries()
+    assert len(calls) == 2
+
+
+def test_price_cache_expiry_follows_publication_cycle():
+    from datetime import datetime, timedelta, timezone
+
+    today = datetime(2024, 3, 5, tzinfo=timezone.utc)
+    today_only = _hourly_series(today, 24)
+    with_tomorrow = _hourly_series(today, 48)
+
+    # Morning with only today's prices: valid until today's publication.
+    morning = today.replace(hour=9)
+    assert lf._price_cache_expiry(today_only, morning) == today.replace(hour=14).timestamp()
+
+    # Afternoon and tomorrow still missing: retry shortly.
+    afternoon = today.replace(hour=15)
+    assert lf._price_cache_expiry(today_only, afternoon) == (
+        afternoon.timestamp() + lf.UNPUBLISHED_RETRY_SECONDS
+    )
+
+    # Tomorrow already known: nothing new until tomorrow's publication.
+    expected = (today + timedelta(days=1)).replace(hour=14).timestamp()
+    assert lf._price_cache_expiry(with_tomorrow, afternoon) == expected
+
+
+def test_disk_cache_survives_container_recycle(monkeypatch, tmp_path):
+    from datetime import datetime, timedelta, timezone
+
+    tz = timezone(timedelta(hours=2))
+    hour_start = datetime.now(tz).replace(minute=0, second=0, microsecond=0)
+    entries = _hourly_series(hour_start, 24, price=0.0421)
+
+    monkeypatch.setitem(lf._PRICE_CACHES, "FI", {"entries": None, "expires_at": 0.0})
+    monkeypatch.setattr(lf, "PRICE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(lf, "_download_price_entries", lambda: (entries, None))
+    lf._fetch_all_price_entries()
+
+    # A fresh container has an empty memory cache and must not hit the API.
+    monkeypatch.setitem(lf._PRICE_CACHES, "FI", {"entries": None, "expires_at": 0.0})
+    monkeypatch.setattr(lf, "_download_price_entries", lambda: pytest.fail("unexpected download"))
+
+    loaded, error = lf._fetch_all_price_entries()
+    assert error is None
+    assert list(loaded) == list(entries)
+    assert loaded[0]["dt"].utcoffset() == timedelta(hours=2)
+
+
+def test_disk_cache_rejects_expired_or_corrupt_file(monkeypatch, tmp_path):
+    from datetime import datetime, timezone
+
+    now = datetime.now(timezone.utc)
+    entries = _hourly_series(now.replace(minute=0, second=0, microsecond=0), 4)
+    monkeypatch.setitem(lf._PRICE_CACHES, "FI", {"entries": None, "expires_at": 0.0})
+    monkeypatch.setattr(lf, "PRICE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(lf, "STALE_WHILE_REVALIDATE", False)
+    downloads = []
+
+    def fake_download():
+        downloads.append(1)
+        return entries, None
+
+    monkeypatch.setattr(lf, "_download_price_entries", fake_download)
+
+    store = lf.FilePriceStore()
+    store.save("FI", entries, now.timestamp() - 1)
+    lf._fetch_all_price_entries()
+    assert len(downloads) == 1
+
+    (tmp_path / lf.PRICE_CACHE_FILE.format(region="FI")).write_bytes(b"garbage")
+    assert store.load("FI") is None
+
+
+def test_stored_validators_that_do_not_fit_or_decode(tmp_path):
+    from datetime import datetime, timezone
+
+    series = _hourly_series(datetime(2024, 3, 5, tzinfo=timezone.utc), 4)
+    store = lf.FilePriceStore(str(tmp_path))
+
+    # Validators too long for the header are dropped, the prices kept.
+    series.validators = {"etag": "x" * 70000, "last_modified": None}
+    store.save("FI", series, 1e12)
+    loaded, _ = store.load("FI")
+    assert list(loaded) == list(series) and loaded.validators is None
+
+    # Non-UTF-8 validator bytes make the file malformed.
+    series.validators = {"etag": "ab", "last_modified": None}
+    data = bytearray(lf._encode_series(series, 1e12))
+    data[-2:] = b"\xff\xfe"
+    (tmp_path / lf.PRICE_CACHE_FILE.format(region="FI")).write_bytes(bytes(data))
+    assert store.load("FI") is None
+
+
+def test_sqlite_store_is_shared_between_containers(monkeypatch, tmp_path):
+    from datetime import datetime, timezone
+
+    hour_start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    entries = _hourly_series(hour_start, 24, price=0.0421)
+    monkeypatch.setattr(lf, "PRICE_STORE", f"sqlite:{tmp_path / 'prices.db'}")
+    monkeypatch.setattr(lf, "_PRICE_STORE_INSTANCE", {"spec": None, "store": None})
+
+    # First container downloads and publishes to the store.
+    monkeypatch.setitem(lf._PRICE_CACHES, "FI", {"entries": None, "expires_at": 0.0})
+    monkeypatch.setattr(lf, "_download_price_entries", lambda: (entries, None))
+    lf._fetch_all_price_entries()
+
+    # Second container, with nothing on its own disk, reads the shared copy.
+    monkeypatch.setitem(lf._PRICE_CACHES, "FI", {"entries": None, "expires_at": 0.0})
+    monkeypatch.setattr(lf, "_PRICE_STORE_INSTANCE", {"spec": None, "store": None})
+    monkeypatch.setattr(lf, "_download_price_entries", lambda: pytest.fail("unexpected download"))
+    loaded, error = lf._fetch_all_price_entries()
+    assert error is None
+    assert list(loaded) == list(entries)
+
+
+def test_refresher_only_background_refresh_reads_store(monkeypatch, tmp_path):
+    from datetime import datetime, timezone
+
+    hour_start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    stale = _hourly_series(hour_start, 24, price=0.05)
+    fresh = _hourly_series(hour_start, 48, price=0.06)
+
+    monkeypatch.setitem(lf._PRICE_CACHES, "FI", {"entries": stale, "expires_at": 0.0})
+    monkeypatch.setattr(lf, "PRICE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(lf, "STALE_WHILE_REVALIDATE", True)
+    monkeypatch.setattr(lf, "PRICE_STORE_REFRESHER_ONLY", True)
+    monkeypatch.setattr(lf, "_download_price_entries", lambda: pytest.fail("unexpected download"))
+
+    # The scheduled refresher has already published newer prices.
+    lf.FilePriceStore().save("FI", fresh, hour_start.timestamp() + 86400)
+
+    assert lf._fetch_all_price_entries() == (stale, None)
+    with lf._refresh_lock("FI"):
+        pass
+    assert list(lf._PRICE_CACHES["FI"]["entries"]) == list(fresh)
+
+
+def test_refresher_only_blocking_refresh_reads_store(monkeypatch, tmp_path):
+    from datetime import datetime, timezone
+
+    hour_start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    stale = _hourly_series(hour_start, 24, price=0.05)
+    fresh = _hourly_series(hour_start, 48, price=0.06)
+    downloads = []
+
+    monkeypatch.setitem(lf._PRICE_CACHES, "FI", {"entries": stale, "expires_at": 0.0})
+    monkeypatch.setattr(lf, "PRICE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(lf, "STALE_WHILE_REVALIDATE", False)
+    monkeypatch.setattr(lf, "PRICE_STORE_REFRESHER_ONLY", True)
+    monkeypatch.setattr(lf, "_download_price_entries", lambda: downloads.append(1) or (fresh, None))
+
+    # Nothing newer yet: the stale prices still cover this hour.
+    assert lf._fetch_all_price_entries() == (stale, None)
+
+    # The scheduled refresher publishes newer prices.
+    lf.FilePriceStore().save("FI", fresh, hour_start.timestamp() + 86400)
+    entries, error = lf._fetch_all_price_entries()
+    assert error is None and list(entries) == list(fresh)
+    assert downloads == []
+
+    # A container without any prices still fetches them itself.
+    lf._PRICE_CACHES["FI"] = {"entries": None, "expires_at": 0.0}
+    (tmp_path / lf.PRICE_CACHE_FILE.format(region="FI")).unlink()
+    assert lf._fetch_all_price_entries() == (fresh, None)
+    assert downloads == [1]
+
+
+def test_stale_entries_served_while_refreshing_in_background(monkeypatch, tmp_path):
+    import threading
+    from datetime import datetime, timezone
+
+    hour_start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    stale = _hourly_series(hour_start, 24, price=0.05)
+    fresh = _hourly_series(hour_start, 48, price=0.06)
+    release = threading.Event()
+
+    def slow_download():
+        release.wait(5)
+        return fresh, None
+
+    monkeypatch.setitem(lf._PRICE_CACHES, "FI", {"entries": stale, "expires_at": 0.0})
+    monkeypatch.setattr(lf, "PRICE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(lf, "STALE_WHILE_REVALIDATE", True)
+    monkeypatch.setattr(lf, "_download_price_entries", slow_download)
+
+    # The expired entries still cover this hour, so they are returned without
+    # waiting for the upstream.
+    assert lf._fetch_all_price_entries() == (stale, None)
+
+    release.set()
+    with lf._refresh_lock("FI"):
+        pass
+    assert lf._PRICE_CACHES["FI"]["entries"] is fresh
+
+
+def test_stale_entries_not_covering_now_block_on_refresh(monkeypatch, tmp_path):
+    from datetime import datetime, timedelta, timezone
+
+    hour_start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    stale = _hourly_series(hour_start - timedelta(days=2), 24)
+    fresh = _hourly_series(hour_start, 24)
+
+    monkeypatch.setitem(lf._PRICE_CACHES, "FI", {"entries": stale, "expires_at": 0.0})
+    monkeypatch.setattr(lf, "PRICE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(lf, "STALE_WHILE_REVALIDATE", True)
+    monkeypatch.setattr(lf, "_download_price_entries", lambda: (fresh, None))
+
+    assert lf._fetch_all_price_entries() == (fresh, None)
+
+
+def test_concurrent_cache_misses_share_one_download(monkeypatch, tmp_path):
+    import threading
+    import time
+    from datetime import datetime, timezone
+
+    hour_start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    entries = _hourly_series(hour_start, 24)
+    release = threading.Event()
+    downloads = []
+
+    def slow_download():
+        downloads.append(1)
+        release.wait(5)
+        return entries, None
+
+    monkeypatch.setitem(lf._PRICE_CACHES, "FI", {"entries": None, "expires_at": 0.0})
+    monkeypatch.setattr(lf, "PRICE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(lf, "_download_price_entries", slow_download)
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(lf._fetch_all_price_entries()))
+        for _ in range(5)
+    ]
+    threads[0].start()
+    deadline = time.monotonic() + 5
+    while not lf._PRICE_FLIGHTS.in_flight(("prices", "FI", True)):
+        assert time.monotonic() < deadline, "first download never started"
+        time.sleep(0.001)
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(downloads) == 1
+    assert results == [(entries, None)] * 5
+
+
+def test_single_flight_propagates_errors_to_all_waiters():
+    import threading
+    import time
+
+    flights = lf.SingleFlight()
+    release = threading.Event()
+    errors = []
+
+    def failing():
+        release.wait(5)
+        raise ValueError("upstream broke")
+
+    def call():
+        try:
+            flights.do("key", failing)
+        except ValueError as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    threads[0].start()
+    while not flights.in_flight("key"):
+        time.sleep(0.001)
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(errors) == 3
+    assert all(exc is errors[0] for exc in errors)
+    # The failed call isn't remembered: the next caller runs again.
+    assert flights.do("key", lambda: 42) == 42
+
+
+def test_single_flight_waiter_gives_up_at_timeout():
+    import threading
+    import time
+
+    flights = lf.SingleFlight()
+    release = threading.Event()
+    leader = threading.Thread(target=lambda: flights.do("key", lambda: release.wait(5)))
+    leader.start()
+    while not flights.in_flight("key"):
+        time.sleep(0.001)
+
+    with pytest.raises(TimeoutError):
+        flights.do("key", lambda: pytest.fail("waiter must not run"), timeout=0.01)
+    release.set()
+    leader.join(5)
+
+
+def test_http_session_is_created_once_and_pooled(monkeypatch):
+    monkeypatch.setattr(lf, "_HTTP_SESSION", None)
+
+    session = lf._get_http_session()
+    assert lf._get_http_session() is session
+
+    adapter = session.get_adapter(lf.SPOT_HINTA_BASE_URL)
+    assert adapter._pool_maxsize == lf.HTTP_POOL_MAXSIZE
+    assert adapter._pool_connections == 2
+    assert adapter.max_retries.total == 0
+
+
+class FakeRaw:
+    def __init__(self, body, chunk_size=None):
+        self.body = body
+        self.chunk_size = chunk_size
+
+    def stream(self, amt, decode_content=True):
+        assert not decode_content
+        step = self.chunk_size or amt
+        for i in range(0, len(self.body), step):
+            yield self.body[i:i + step]
+
+
+class FakeResponse:
+    """Streamed API response: `payload` is served as JSON, `body` as is."""
+
+    def __init__(self, payload=None, status_code=200, headers=None, body=None, chunk_size=None):
+        import json
+
+        if body is None:
+            body = json.dumps(payload).encode()
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.raw = FakeRaw(body, chunk_size)
+        self.closed = False
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+ONE_PRICE = [{"DateTime": "2024-03-05T00:00:00+02:00", "PriceWithTax": 0.01}]
+
+
+def test_download_uses_shared_session(monkeypatch):
+    payload = [
+        {"DateTime": "2024-03-05T01:00:00+02:00", "PriceWithTax": 0.02},
+        {"DateTime": "2024-03-05T00:00:00+02:00", "PriceWithTax": 0.01},
+    ]
+
+    class FakeSession:
+        def __init__(self):
+            self.calls = []
+
+        def get(self, url, **kwargs):
+            self.calls.append(url)
+            return FakeResponse(payload)
+
+    session = FakeSession()
+    monkeypatch.setattr(lf, "_HTTP_SESSION", session)
+
+    entries, error = lf._download_price_entries()
+    assert error is None
+    assert [e["price"] for e in entries] == [0.01, 0.02]
+    assert session.calls == [f"{lf.SPOT_HINTA_BASE_URL}/TodayAndDayForward"]
+
+
+def test_circuit_opens_after_consecutive_failures_and_probes(monkeypatch):
+    import requests
+
+    calls = []
+
+    class FailingSession:
+        def get(self, url, **kwargs):
+            calls.append(url)
+            raise requests.exceptions.ConnectionError()
+
+    monkeypatch.setattr(lf, "_HTTP_SESSION", FailingSession())
+    breaker = lf.CircuitBreaker(failure_threshold=2, open_seconds=60)
+    monkeypatch.setitem(lf._UPSTREAM_BREAKERS, "FI", breaker)
+
+    for _ in range(2):
+        assert lf._download_price_entries() == (None, lf.UNAVAILABLE_MESSAGE)
+    assert breaker.state == breaker.OPEN
+
+    # Open: answered from the negative cache without touching the network.
+    assert lf._download_price_entries() == (None, lf.UNAVAILABLE_MESSAGE)
+    assert len(calls) == 2
+
+    # After the open period one probe goes through; its failure re-opens.
+    breaker.opened_at -= 60
+    lf._download_price_entries()
+    assert len(calls) == 3
+    assert breaker.state == breaker.OPEN
+    lf._download_price_entries()
+    assert len(calls) == 3
+
+
+def test_circuit_trips_on_429_and_closes_after_successful_probe(monkeypatch):
+    statuses = [429, 200]
+
+    class FakeSession:
+        def get(self, url, **kwargs):
+            return FakeResponse(ONE_PRICE, status_code=statuses.pop(0))
+
+    monkeypatch.setattr(lf, "_HTTP_SESSION", FakeSession())
+    breaker = lf._upstream_breaker("FI")
+
+    assert lf._download_price_entries() == (None, lf.UNAVAILABLE_MESSAGE)
+    assert breaker.state == breaker.OPEN
+
+    breaker.opened_at -= breaker.open_seconds
+    entries, error = lf._download_price_entries()
+    assert error is None and len(entries) == 1
+    assert breaker.state == breaker.CLOSED
+
+
+@pytest.mark.parametrize("payload", [[1, 2], [{"DateTime": 5, "PriceWithTax": "x"}], [None]])
+def test_download_reports_wrong_shaped_payload_as_parse_error(monkeypatch, payload):
+    class FakeSession:
+        def get(self, url, **kwargs):
+            return FakeResponse(payload)
+
+    monkeypatch.setattr(lf, "_HTTP_SESSION", FakeSession())
+
+    assert lf._download_price_entries() == (None, "I'm sorry, I couldn't parse the electricity price data.")
+    # The API did answer.
+    assert lf._upstream_breaker("FI").failures == 0
+
+
+def test_unexpected_error_in_probe_does_not_leave_circuit_half_open(monkeypatch):
+    class FakeSession:
+        def get(self, url, **kwargs):
+            return FakeResponse(ONE_PRICE)
+
+    def broken_parser(*columns):
+        raise RuntimeError("bug")
+
+    monkeypatch.setattr(lf, "_HTTP_SESSION", FakeSession())
+    monkeypatch.setattr(lf, "_series_from_columns", broken_parser)
+    breaker = lf._upstream_breaker("FI")
+    breaker.record_failure(lf.UNAVAILABLE_MESSAGE, trip=True)
+    breaker.opened_at -= breaker.open_seconds
+
+    with pytest.raises(RuntimeError):
+        lf._download_price_entries()
+    assert breaker.state == breaker.OPEN
+
+
+def test_token_bucket_limits_rate_and_honors_defer():
+    bucket = lf.TokenBucket(rate_per_minute=600, capacity=2)
+    assert bucket.acquire(0)
+    assert bucket.acquire(0)
+    assert not bucket.acquire(0)
+    # A token comes back every 0.1 seconds at 600 per minute.
+    assert bucket.acquire(0.5)
+
+    bucket = lf.TokenBucket(rate_per_minute=600, capacity=2)
+    bucket.defer(30)
+    assert not bucket.acquire(1)
+
+
+def test_sqlite_token_bucket_is_shared(tmp_path):
+    path = str(tmp_path / "limits.db")
+    first = lf.SQLiteTokenBucket(path, rate_per_minute=1, capacity=2)
+    second = lf.SQLiteTokenBucket(path, rate_per_minute=1, capacity=2)
+
+    assert first.acquire(0)
+    assert second.acquire(0)
+    assert not first.acquire(0)
+    second.defer(60)
+    assert not lf.SQLiteTokenBucket(path, 60, 10).acquire(1)
+
+
+def test_parse_retry_after():
+    from email.utils import formatdate
+    import time
+
+    assert lf._parse_retry_after("120") == 120
+    assert 55 < lf._parse_retry_after(formatdate(time.time() + 60, usegmt=True)) <= 60
+    assert lf._parse_retry_after("soon") is None
+    assert lf._parse_retry_after(None) is None
+
+
+def test_retry_after_blocks_calls_until_it_passes(monkeypatch):
+    calls = []
+
+    class FakeSession:
+        def get(self, url, **kwargs):
+            calls.append(url)
+            return FakeResponse(status_code=429, headers={"Retry-After": "120"})
+
+    monkeypatch.setattr(lf, "_HTTP_SESSION", FakeSession())
+    breaker = lf._upstream_breaker("FI")
+
+    assert lf._download_price_entries() == (None, lf.UNAVAILABLE_MESSAGE)
+    assert len(calls) == 1
+
+    # The circuit's open period ends first, but the probe is held back by
+    # Retry-After and handed back rather than left half-open.
+    breaker.opened_at -= breaker.open_seconds
+    assert lf._download_price_entries() == (None, lf.UNAVAILABLE_MESSAGE)
+    assert len(calls) == 1
+    assert breaker.state == breaker.OPEN
+
+
+def test_failed_refresh_serves_expired_prices_covering_now(monkeypatch, tmp_path):
+    from datetime import datetime, timezone
+
+    hour_start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    stale = _hourly_series(hour_start, 24)
+
+    monkeypatch.setitem(lf._PRICE_CACHES, "FI", {"entries": stale, "expires_at": 0.0})
+    monkeypatch.setattr(lf, "PRICE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(lf, "STALE_WHILE_REVALIDATE", False)
+    monkeypatch.setattr(lf, "_download_price_entries", lambda: (None, lf.UNAVAILABLE_MESSAGE))
+
+    assert lf._fetch_all_price_entries() == (stale, None)
+
+
+def test_refresh_revalidates_with_validators_and_reuses_on_304(monkeypatch, tmp_path):
+    from datetime import datetime, timezone
+
+    hour_start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    cached = _hourly_series(hour_start, 24)
+    cached.validators = {"etag": '"v1"', "last_modified": "Tue, 05 Mar 2024 12:00:00 GMT"}
+    seen = {}
+
+    class FakeSession:
+        def get(self, url, headers=None, **kwargs):
+            seen.update(headers)
+            return FakeResponse(status_code=304, body=b"")
+
+    monkeypatch.setitem(lf._PRICE_CACHES, "FI", {"entries": cached, "expires_at": 0.0})
+    monkeypatch.setattr(lf, "PRICE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(lf, "STALE_WHILE_REVALIDATE", False)
+    monkeypatch.setattr(lf, "_HTTP_SESSION", FakeSession())
+
+    assert lf._fetch_all_price_entries() == (cached, None)
+    assert seen == {
+        "If-None-Match": '"v1"',
+        "If-Modified-Since": "Tue, 05 Mar 2024 12:00:00 GMT",
+    }
+    # The unchanged series is valid again, and persisted with its validators.
+    assert lf._PRICE_CACHES["FI"]["expires_at"] > hour_start.timestamp()
+    stored, _ = lf.FilePriceStore().load("FI")
+    assert stored.validators == cached.validators
+
+
+def test_download_keeps_response_validators(monkeypatch):
+    class FakeSession:
+        def get(self, url, **kwargs):
+            return FakeResponse(ONE_PRICE, headers={"ETag": '"v2"'})
+
+    monkeypatch.setitem(lf._PRICE_CACHES, "FI", {"entries": None, "expires_at": 0.0})
+    monkeypatch.setattr(lf, "_HTTP_SESSION", FakeSession())
+
+    series, error = lf._download_price_entries()
+    assert error is None
+    assert series.validators == {"etag": '"v2"', "last_modified": None}
+
+
+def test_download_decodes_compressed_body_and_counts_wire_bytes(monkeypatch):
+    import gzip
+    import json
+
+    body = json.dumps(ONE_PRICE * 50).encode()
+    response = FakeResponse(body=gzip.compress(body), headers={"Content-Encoding": "gzip"})
+
+    class FakeSession:
+        def get(self, url, stream=False, **kwargs):
+            assert stream
+            return response
+
+    monkeypatch.setattr(lf, "_HTTP_SESSION", FakeSession())
+    monkeypatch.setattr(lf, "_TRANSFER_STATS", dict.fromkeys(lf._TRANSFER_STATS, 0))
+
+    series, error = lf._download_price_entries()
+    assert error is None and len(series) == 50
+    assert response.closed
+    assert lf._TRANSFER_STATS["responses"] == 1
+    assert lf._TRANSFER_STATS["wire_bytes"] == len(response.raw.body)
+    assert lf._TRANSFER_STATS["decoded_bytes"] == len(body)
+
+
+def test_download_rejects_corrupt_compressed_body(monkeypatch):
+    class FakeSession:
+        def get(self, url, **kwargs):
+            return FakeResponse(body=b"not gzip", headers={"Content-Encoding": "gzip"})
+
+    monkeypatch.setattr(lf, "_HTTP_SESSION", FakeSession())
+    assert lf._download_price_entries() == (None, lf.UNAVAILABLE_MESSAGE)
+
+
+def test_scanner_extracts_columns_across_chunk_boundaries(monkeypatch):
+    import gzip
+    import json
+    from datetime import datetime, timedelta, timezone
+
+    data = _payload(datetime(2024, 3, 5, tzinfo=timezone(timedelta(hours=2))), 96)
+    for item in data:
+        item.update({"Rank": 3, "PriceNoTax": 0.04})
+    body = json.dumps(data, indent=1).encode()
+    responses = [
+        FakeResponse(body=body, chunk_size=7),
+        FakeResponse(body=gzip.compress(body), headers={"Content-Encoding": "gzip"}, chunk_size=5),
+    ]
+
+    class FakeSession:
+        def get(self, url, **kwargs):
+            return responses.pop(0)
+
+    monkeypatch.setattr(lf, "_HTTP_SESSION", FakeSession())
+    monkeypatch.setattr(json, "loads", lambda *args: pytest.fail("fell back to json.loads"))
+
+    for _ in range(2):
+        monkeypatch.setitem(lf._PRICE_CACHES, "FI", {"entries": None, "expires_at": 0.0})
+        series, error = lf._download_price_entries()
+        assert error is None
+        assert [e["price"] for e in series] == [d["PriceWithTax"] for d in data]
+
+
+def test_scanner_rejects_unexpected_shapes():
+    for body in (b'{"DateTime": "x"}', b'[]', b'[{"a": {"b": 1}}]', b'[{"DateTime": "x"}'):
+        scanner = lf._PriceColumnScanner()
+        scanner.feed(body)
+        assert scanner.columns() is None
+
+    scanner = lf._PriceColumnScanner()
+    scanner.feed(b'[{"DateTime": "2024-03-05T00:00:00Z", "PriceWithTax": null}]')
+    assert scanner.columns() == (["2024-03-05T00:00:00Z"], [None])
+
+
+def test_download_falls_back_to_json_for_unexpected_shape(monkeypatch):
+    payload = [{"Nested": {"x": 1}, "DateTime": "2024-03-05T00:00:00+02:00", "PriceWithTax": 0.01}]
+
+    class FakeSession:
+        def get(self, url, **kwargs):
+            return FakeResponse(payload)
+
+    monkeypatch.setitem(lf._PRICE_CACHES, "FI", {"entries": None, "expires_at": 0.0})
+    monkeypatch.setattr(lf, "_HTTP_SESSION", FakeSession())
+    series, error = lf._download_price_entries()
+    assert error is None and len(series) == 1
+
+
+def test_accept_encoding_offers_installed_codecs(monkeypatch):
+    monkeypatch.setattr(lf, "_CODECS", {"br": object(), "zstd": None})
+    assert lf._accept_encoding() == "br, gzip"
+
+    monkeypatch.setattr(lf, "HTTP_COMPRESSION", "identity")
+    assert lf._accept_encoding() == "identity"
+
+
+def test_decode_content_handles_stacked_and_unknown_codings():
+    import gzip
+    import zlib
+
+    data = b"price data"
+    assert lf._decode_content(data, None) == data
+    assert lf._decode_content(zlib.compress(gzip.compress(data)), "gzip, deflate") == data
+    with pytest.raises(ValueError):
+        lf._decode_content(data, "compress")
+
+
+class FakeLambdaContext:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+def test_deadline_is_capped_by_alexa_window_and_lambda_time():
+    generous = lf.Deadline.from_context(FakeLambdaContext(60000))
+    assert generous.remaining() <= (lf.ALEXA_RESPONSE_TIMEOUT_MS - lf.RESPONSE_RESERVE_MS) / 1000
+
+    tight = lf.Deadline.from_context(FakeLambdaContext(lf.RESPONSE_RESERVE_MS + 100))
+    assert tight.remaining() <= 0.1
+    assert lf.Deadline.from_context(None).remaining() > 0
+
+
+def test_fetch_uses_request_deadline_as_timeout(monkeypatch):
+    import requests
+
+    seen = {}
+
+    class FakeSession:
+        def get(self, url, params=None, timeout=None, **kwargs):
+            seen["timeout"] = timeout
+            raise requests.exceptions.ReadTimeout()
+
+    monkeypatch.setattr(lf, "_HTTP_SESSION", FakeSession())
+
+    token = lf._REQUEST_DEADLINE.set(lf.Deadline(1500))
+    try:
+        entries, error = lf._download_price_entries()
+    finally:
+        lf._REQUEST_DEADLINE.reset(token)
+
+    assert entries is None
+    assert error == lf.TIMEOUT_MESSAGE
+    assert 0 < seen["timeout"] <= 1.5
+
+
+def test_fetch_skipped_when_deadline_nearly_spent(monkeypatch):
+    monkeypatch.setattr(lf, "_HTTP_SESSION", None)
+    monkeypatch.setattr(lf, "_get_http_session", lambda: pytest.fail("unexpected fetch"))
+
+    token = lf._REQUEST_DEADLINE.set(lf.Deadline(0))
+    try:
+        assert lf._download_price_entries() == (None, lf.TIMEOUT_MESSAGE)
+    finally:
+        lf._REQUEST_DEADLINE.reset(token)
+
+
+def test_download_finishing_past_deadline_still_fills_cache(monkeypatch, tmp_path):
+    import time
+    from datetime import datetime, timezone
+
+    hour_start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    calls = []
+
+    class SlowSession:
+        def get(self, url, **kwargs):
+            calls.append(url)
+            time.sleep(0.5)
+            return FakeResponse(_payload(hour_start, 24, minutes=60))
+
+    monkeypatch.setattr(lf, "_HTTP_SESSION", SlowSession())
+    monkeypatch.setattr(lf, "_PRICE_CACHES", {})
+    monkeypatch.setattr(lf, "_ANSWER_CACHE", _empty_answer_cache())
+    monkeypatch.setattr(lf, "PRICE_CACHE_DIR", str(tmp_path))
+    context = FakeLambdaContext(lf.RESPONSE_RESERVE_MS + 400)
+    event = make_event("IntentRequest", intent_name="GetSpotPriceIntent")
+
+    first = lf.lambda_handler(event, context)["response"]["outputSpeech"]["ssml"]
+    assert lf.TIMEOUT_MESSAGE in first
+    assert lf.FilePriceStore().load("FI") is not None
+
+    second = lf.lambda_handler(event, context)["response"]["outputSpeech"]["ssml"]
+    assert "The current electricity spot price" in second
+    assert len(calls) == 1
+
+
+def _payload(start, count, minutes=15):
+    from datetime import timedelta
+
+    return [
+        {
+            "DateTime": (start + timedelta(minutes=minutes * i)).isoformat(),
+            "PriceWithTax": round(0.01 * (i % 7), 4),
+        }
+        for i in range(count)
+    ]
+
+
+def test_regular_payload_parsed_arithmetically(monkeypatch):
+    from datetime import datetime, timedelta, timezone
+
+    tz = timezone(timedelta(hours=2))
+    data = _payload(datetime(2024, 3, 5, tzinfo=tz), 192)
+    parsed = []
+    real_parse = lf._parse_iso_datetime
+    monkeypatch.setattr(lf, "_parse_iso_datetime", lambda s: parsed.append(s) or real_parse(s))
+
+    fast = lf._series_from_payload(data)
+    assert len(parsed) == 2
+
+    slow = lf._series_from_items([d["DateTime"] for d in data], [d["PriceWithTax"] for d in data])
+    assert fast.timestamps == slow.timestamps
+    assert fast.prices == slow.prices
+    assert fast.dt(0).utcoffset() == timedelta(hours=2)
+
+
+def test_irregular_payload_falls_back_to_per_item_parsing():
+    from datetime import datetime, timedelta, timezone
+
+    start = datetime(2024, 3, 5, tzinfo=timezone(timedelta(hours=2)))
+    data = _payload(start, 8)
+
+    gap = data[:3] + data[4:]
+    reordered = [data[1], data[0]] + data[2:]
+    null_price = data[:5] + [{"DateTime": data[5]["DateTime"], "PriceWithTax": None}] + data[6:]
+    def columns(payload):
+        return [d["DateTime"] for d in payload], [d["PriceWithTax"] for d in payload]
+
+    # Off the grid only between the first two and the last slot, where
+    # sampling a few timestamps wouldn't notice.
+    hours = _payload(start, 9, minutes=60)
+    duplicate = hours[:3] + [hours[2]] + hours[4:5] + [{"DateTime": None, "PriceWithTax": 0.01}] + hours[6:]
+    shifted = data[:3] + [{"DateTime": data[3]["DateTime"].replace(":45:", ":50:"), "PriceWithTax": 0.0}] + data[4:]
+    other_offset = data[:6] + [{"DateTime": data[6]["DateTime"].replace("+02:00", "+03:00"), "PriceWithTax": 0.0}] + data[7:]
+
+    for payload in (gap, reordered, null_price, duplicate, shifted, other_offset):
+        assert lf._series_from_regular_columns(*columns(payload)) is None
+        series = lf._series_from_payload(payload)
+        assert list(series) == list(lf._series_from_items(*columns(payload)))
+
+    assert list(lf._series_from_payload(reordered)) == list(lf._series_from_payload(data))
+    assert len(lf._series_from_payload(null_price)) == 7
+    assert len(lf._series_from_payload(duplicate)) == 8
+    assert lf._series_from_payload([{"DateTime": "garbage", "PriceWithTax": 1}]) is None
+
+
+def test_regular_payload_across_days_and_dst_change():
+    from datetime import datetime, timedelta, timezone
+
+    # Three days of 15-minute slots starting mid-afternoon.
+    data = _payload(datetime(2024, 3, 5, 14, 30, tzinfo=timezone(timedelta(hours=2))), 288)
+    columns = [d["DateTime"] for d in data], [d["PriceWithTax"] for d in data]
+    fast = lf._series_from_regular_columns(*columns)
+    assert fast is not None
+    assert list(fast) == list(lf._series_from_items(*columns))
+
+    # Finland leaves summer time at 04:00 on 27 October: two offsets, so the
+    # per-item parser sorts it out.
+    utc = datetime(2024, 10, 26, 21, tzinfo=timezone.utc)
+    dst = [
+        {"DateTime": (utc + timedelta(hours=i)).astimezone(timezone(timedelta(hours=3 if i < 4 else 2))).isoformat(),
+         "PriceWithTax": 0.01}
+        for i in range(8)
+    ]
+    series = lf._series_from_payload(dst)
+    assert list(series.timestamps) == [int((utc + timedelta(hours=i)).timestamp()) for i in range(8)]
+
+
+def test_price_series_columns_and_day_ranges():
+    from datetime import datetime, timedelta, timezone
+
+    tz = timezone(timedelta(hours=2))
+    start = datetime(2024, 3, 5, 22, tzinfo=tz)
+    series = _hourly_series(start, 5, price=0.03)
+
+    assert len(series) == 5
+    assert series.timestamps[1] - series.timestamps[0] == 3600
+    assert series.slot_seconds() == 3600
+    assert series[0] == {"dt": start, "price": 0.03}
+    assert series.dt(2).tzinfo == tz
+
+    # 22:00 and 23:00 are on the 5th, the rest fall on the 6th local time.
+    assert series.day_range(start.date()) == (0, 2)
+    assert series.day_range((start + timedelta(days=1)).date()) == (2, 5)
+    day_after = series.day_range((start + timedelta(days=2)).date())
+    assert day_after[0] == day_after[1]
+    assert series.last_day() == (start + timedelta(days=1)).date()
+
+
+def test_price_series_slot_lookup_by_bisection():
+    from datetime import datetime, timedelta, timezone
+
+    start = datetime(2024, 3, 5, 0, tzinfo=timezone.utc)
+    # Quarter-hour slots across two days.
+    entries = [{"dt": start + timedelta(minutes=15 * i), "price": 0.01} for i in range(192)]
+    series = lf.PriceSeries.from_entries(entries)
+    base = series.timestamps[0]
+
+    assert series.slot_index(base - 1) == -1
+    assert series.slot_index(base) == 0
+    assert series.slot_index(base + 14 * 60) == 0
+    assert series.slot_index(base + 15 * 60) == 1
+    assert series.slot_index(base + 10 * 86400) == 191
+
+    assert series.first_index_from(base + 1) == 1
+    assert series.day_start_index((start + timedelta(days=1)).date()) == 96
+    assert series.day_range(start.date()) == (0, 96)
+
+
+def test_price_windows_match_brute_force():
+    import random
+
+    rng = random.Random(7)
+    prices = [round(rng.uniform(0.0, 0.15), 4) for _ in range(60)]
+
+    for k in (1, 3, 8, 24):
+        start, end = 5, 50
+        windows = lf.PriceWindows(prices, start, end, k)
+        starts = range(start, end - k + 1)
+        assert len(windows) == len(starts)
+
+        sums = [sum(prices[i:i + k]) for i in starts]
+        best = min(sums)
+        # Earliest window whose total equals the minimum (within float noise).
+        expected = next(i for i, s in zip(starts, sums) if abs(s - best) < 1e-9)
+        assert windows.cheapest() == expected
+
+        for limit in (3.0, 7.0, 12.0):
+            qualifying = [i for i in starts if all(p * 100 <= limit for p in prices[i:i + k])]
+            assert windows.at_most_cents(limit) == qualifying
+            assert windows.earliest_at_most_cents(limit) == (qualifying[0] if qualifying else None)
+            assert all(windows.max_at(i) == max(prices[i:i + k]) for i in starts)
+
+
+def test_price_windows_empty_when_range_shorter_than_window():
+    windows = lf.PriceWindows([0.01, 0.02], 0, 2, 3)
+    assert len(windows) == 0
+    assert windows.cheapest() is None
+    assert windows.earliest_at_most_cents(100.0) is None
+
+
+def test_parse_run_machine_slots():
+    intent = {
+        "name": "ShouldIRunMachineIntent",
+        "slots": {
+            "duration": {"name": "duration", "value": "PT1H30M"},
+            "threshold": {"name": "threshold", "value": "5.5"},
+        },
+    }
+    assert lf._run_machine_options(intent) == {"duration_minutes": 90, "threshold_cents": 5.5}
+
+    assert lf._parse_duration_minutes("PT8H") == 480
+    assert lf._parse_duration_minutes("2") == 120
+    assert lf._parse_duration_minutes("?") is None
+    for value in ("inf", "1e400", "nan", "-2", "0", "0.001"):
+        assert lf._parse_duration_minutes(value) is None
+    for value in ("inf", "-inf", "1e400", "nan", "cheap"):
+        assert lf._parse_threshold_cents(value) is None
+    assert lf._parse_threshold_cents("0") == 0.0
+    assert lf._parse_threshold_cents("-3") == -3.0
+    assert lf._run_machine_options({"name": "ShouldIRunMachineIntent"}) == {
+        "duration_minutes": None,
+        "threshold_cents": None,
+    }
+
+
+def test_should_i_run_machine_uses_duration_and_threshold_slots(monkeypatch):
+    from datetime import datetime, timedelta, timezone
+
+    now = datetime.now(timezone.utc)
+    hour_start = now.replace(minute=0, second=0, microsecond=0)
+
+    # Only the current hour is cheap: a one-hour run under 4 cents fits now,
+    # the default three-hour run under 7 cents doesn't.
+    prices = [0.03, 0.08, 0.08, 0.08]
+    entries = [{"dt": hour_start + timedelta(hours=i), "price": p} for i, p in enumerate(prices)]
+    monkeypatch.setattr(lf, "_fetch_all_price_entries", lambda: (entries, None))
+
+    event = make_event("IntentRequest", intent_name="ShouldIRunMachineIntent")
+    event["request"]["intent"]["slots"] = {
+        "duration": {"name": "duration", "value": "PT1H"},
+        "threshold": {"name": "threshold", "value": "4"},
+    }
+    ssml = lf.lambda_handler(event, None)["response"]["outputSpeech"]["ssml"]
+    assert "Yes, now is a good time." in ssml
+
+    assert "Yes, now is a good time." not in lf.get_run_machine_ssml()
+
+    # "When the price is zero" means zero, not the default threshold.
+    event["request"]["intent"]["slots"]["threshold"]["value"] = "0"
+    ssml = lf.lambda_handler(event, None)["response"]["outputSpeech"]["ssml"]
+    assert "Yes, now is a good time." not in ssml
+    entries[0]["price"] = -0.001
+    ssml = lf.lambda_handler(event, None)["response"]["outputSpeech"]["ssml"]
+    assert "Yes, now is a good time." in ssml
+
+
+def test_should_i_run_machine_window_crosses_midnight(monkeypatch):
+    from datetime import datetime, timedelta, timezone
+
+    desired_now = datetime(2024, 3, 5, 21, 10, tzinfo=timezone.utc)
+
+    class FakeDateTime:
+        @staticmethod
+        def now(tz=None):
+            if tz is None:
+                return desired_now
+            return desired_now.astimezone(tz)
+
+    monkeypatch.setattr(lf, "datetime", FakeDateTime)
+
+    # 21:00 and 22:00 are expensive; 23:00 today plus 00:00-01:00 tomorrow
+    # make a cheap three-hour run that starts today.
+    start = datetime(2024, 3, 5, 21, tzinfo=timezone.utc)
+    prices = [0.10, 0.10, 0.05, 0.05, 0.05] + [0.10] * 22
+    entries = [{"dt": start + timedelta(hours=i), "price": p} for i, p in enumerate(prices)]
+    monkeypatch.setattr(lf, "_fetch_all_price_entries", lambda: (entries, None))
+
+    ssml = lf.get_run_machine_ssml()
+    assert ssml == '<speak>No, run it at <say-as interpret-as="time">23:00</say-as>.</speak>'
+
+
+def test_should_i_run_machine_rejects_out_of_range_duration():
+    assert "between fifteen minutes and twelve hours" in lf.get_run_machine_ssml(duration_minutes=13 * 60)
+    assert lf._duration_phrase(180) == "three-hour"
+    assert lf._duration_phrase(90) == "90-minute"
+
+
+def _quarter_hour_entries(start, prices):
+    from datetime import timedelta
+
+    return [{"dt": start + timedelta(minutes=15 * i), "price": p} for i, p in enumerate(prices)]
+
+
+def test_spot_price_averages_quarter_hours(monkeypatch):
+    from datetime import datetime, timezone
+
+    hour_start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    prices = [0.04, 0.06, 0.05, 0.05] + [0.10] * 4 + [0.02] * 8
+    entries = _quarter_hour_entries(hour_start, prices)
+    monkeypatch.setattr(lf, "_fetch_all_price_entries", lambda: (entries, None))
+
+    hourly, error = lf._get_price_entries(4)
+    assert error is None
+    assert [round(e["price"], 4) for e in hourly] == [0.05, 0.10, 0.02, 0.02]
+    assert hourly[1]["dt"] == entries[4]["dt"]
+
+    msg = lf.get_spot_price()
+    assert "is 5.0 cents per kilowatt-hour" in msg
+    assert "Next hour 10.0 cents" in msg
+
+
+def test_cheapest_and_run_machine_use_quarter_hour_slots(monkeypatch):
+    from datetime import datetime, timezone
+
+    desired_now = datetime(2024, 3, 5, 9, 20, tzinfo=timezone.utc)
+
+    class FakeDateTime:
+        @staticmethod
+        def now(tz=None):
+            if tz is None:
+                return desired_now
+            return desired_now.astimezone(tz)
+
+    monkeypatch.setattr(lf, "datetime", FakeDateTime)
+
+    # 09:00 onwards in quarter hours; 09:00 has already passed and is the
+    # cheapest slot, so it must be ignored. 10:30-11:45 is a cheap 90 minutes.
+    prices = [0.01, 0.08, 0.08, 0.08, 0.08, 0.08, 0.03, 0.04, 0.04, 0.04, 0.04, 0.04] + [0.09] * 20
+    entries = _quarter_hour_entries(datetime(2024, 3, 5, 9, tzinfo=timezone.utc), prices)
+    monkeypatch.setattr(lf, "_fetch_all_price_entries", lambda: (entries, None))
+
+    ssml = lf.get_cheapest_price_ssml()
+    assert '<say-as interpret-as="cardinal">3.0</say-as>' in ssml
+    assert '<say-as interpret-as="time">10:30</say-as>' in ssml
+
+    ssml = lf.get_run_machine_ssml(duration_minutes=90, threshold_cents=5.0)
+    assert ssml == '<speak>No, run it at <say-as interpret-as="time">10:30</say-as>.</speak>'
+
+
+def test_module_import_does_not_load_requests():
+    import subprocess
+    import sys
+    from pathlib import Path
+
+    code = "import sys, lambda_function; print('requests' in sys.modules)"
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=Path(lf.__file__).parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == "False"
+
+
+def test_startup_profile_reported_once_after_first_invocation(monkeypatch, capsys):
+    import json
+
+    monkeypatch.setattr(lf, "STARTUP_PROFILE", True)
+    monkeypatch.setattr(lf, "_STARTUP_TIMINGS", {})
+    monkeypatch.setattr(lf, "_STARTUP_STATE", {"module_init_ms": 3.5, "reported": False})
+
+    lf.lambda_handler(make_event("LaunchRequest"), None)
+    lf.lambda_handler(make_event("LaunchRequest"), None)
+
+    lines = capsys.readouterr().out.strip().splitlines()
+    assert len(lines) == 1
+    report = json.loads(lines[0])["startup_profile"]
+    assert report["module_init_ms"] == 3.5
+    assert set(report["stages"]["first_invocation"]) == {"ms", "modules_loaded"}
+
+
+def test_first_fetch_stage_covers_body_and_parse(monkeypatch):
+    import time
+
+    real_parse = lf._series_from_columns
+
+    def slow_parse(*columns):
+        time.sleep(0.05)
+        return real_parse(*columns)
+
+    class FakeSession:
+        def get(self, url, **kwargs):
+            return FakeResponse(ONE_PRICE)
+
+    monkeypatch.setattr(lf, "STARTUP_PROFILE", True)
+    monkeypatch.setattr(lf, "_STARTUP_TIMINGS", {})
+    monkeypatch.setattr(lf, "_HTTP_SESSION", FakeSession())
+    monkeypatch.setattr(lf, "_series_from_columns", slow_parse)
+
+    entries, error = lf._download_price_entries()
+    assert error is None
+    assert lf._STARTUP_TIMINGS["first_fetch"]["ms"] >= 50
+
+
+def test_startup_stage_is_free_when_profiling_disabled(monkeypatch):
+    monkeypatch.setattr(lf, "STARTUP_PROFILE", False)
+    monkeypatch.setattr(lf, "_STARTUP_TIMINGS", {})
+
+    with lf._startup_stage("first_fetch"):
+        pass
+    assert lf._STARTUP_TIMINGS == {}
+
+
+def test_parse_importtime_output():
+    import measure_cold_start
+
+    stderr = "\n".join([
+        "import time: self [us] | cumulative | imported package",
+        "import time:       300 |        300 |   _io",
+        "import time:      2000 |       2500 | site",
+        "import time:       400 |        400 |     _datetime",
+        "import time:      1600 |       2000 |   datetime",
+        "import time:      3000 |       5000 | lambda_function",
+    ])
+    rows = measure_cold_start.parse_importtime(stderr)
+    assert rows[0] == ("  _io", 300, 300)
+    assert rows[-1] == ("lambda_function", 3000, 5000)
+
+    code_rows = rows[measure_cold_start._first_code_import(rows):]
+    assert measure_cold_start._top_level_total(code_rows) == 5000
+
+
+def _empty_answer_cache():
+    return {"regions": {}, "hits": 0, "misses": 0}
+
+
+def test_warmup_event_refreshes_cache_and_precomputes_answers(monkeypatch, tmp_path):
+    from datetime import datetime, timezone
+
+    hour_start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    series = _hourly_series(hour_start, 48, price=0.05)
+    downloads = []
+
+    def fake_download():
+        downloads.append(1)
+        return series, None
+
+    monkeypatch.setitem(lf._PRICE_CACHES, "FI", {"entries": None, "expires_at": 0.0})
+    monkeypatch.setattr(lf, "_ANSWER_CACHE", _empty_answer_cache())
+    monkeypatch.setattr(lf, "PRICE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(lf, "_download_price_entries", fake_download)
+
+    result = lf.lambda_handler({"source": "aws.events", "detail-type": "Scheduled Event"}, None)
+    assert result == {"warmup": {"ok": True, "regions": {"FI": {"ok": True, "entries": 48, "answers": 3}}}}
+    assert len(downloads) == 1
+
+    # Real requests in the same slot are answered without recomputing.
+    for name in ("_spot_price_ssml", "_cheapest_price_ssml", "_run_machine_ssml"):
+        monkeypatch.setattr(lf, name, lambda *args: pytest.fail("answer was recomputed"))
+
+    for intent_name in ("GetSpotPriceIntent", "CheapestPriceIntent", "ShouldIRunMachineIntent"):
+        resp = lf.lambda_handler(make_event("IntentRequest", intent_name=intent_name), None)
+        assert any(v in resp["response"]["outputSpeech"]["ssml"] for v in lf.CLOSING_CUES)
+    assert len(downloads) == 1
+    assert lf._ANSWER_CACHE["hits"] == 3
+
+
+def test_failed_warmup_calls_api_once(monkeypatch, tmp_path):
+    from datetime import datetime, timezone
+
+    hour_start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    downloads = []
+
+    def failing_download():
+        downloads.append(1)
+        return None, lf.UNAVAILABLE_MESSAGE
+
+    monkeypatch.setitem(lf._PRICE_CACHES, "FI", {"entries": None, "expires_at": 0.0})
+    monkeypatch.setattr(lf, "_ANSWER_CACHE", _empty_answer_cache())
+    monkeypatch.setattr(lf, "PRICE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(lf, "_download_price_entries", failing_download)
+
+    result = lf.lambda_handler({"warmup": True}, None)
+    assert result["warmup"]["regions"]["FI"] == {"ok": False, "error": lf.UNAVAILABLE_MESSAGE}
+    assert len(downloads) == 1
+
+    # Expired prices in memory that still cover this hour are kept for the
+    # requests, without answers precomputed from them.
+    lf._PRICE_CACHES["FI"]["entries"] = _hourly_series(hour_start, 24)
+    result = lf.lambda_handler({"warmup": True}, None)
+    assert result["warmup"]["regions"]["FI"] == {"ok": False, "error": lf.UNAVAILABLE_MESSAGE, "entries": 24}
+    assert len(downloads) == 2
+    assert lf._ANSWER_CACHE["regions"] == {}
+
+
+def test_answer_cache_keys_on_slot_values_and_data_version(monkeypatch):
+    from datetime import datetime, timezone
+
+    hour_start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    old = _hourly_series(hour_start, 24)
+    same_prices = _hourly_series(hour_start, 24)
+    new = _hourly_series(hour_start, 48)
+    calls = []
+
+    def compute(series):
+        calls.append(series)
+        return f"<speak>{len(series)}</speak>"
+
+    monkeypatch.setattr(lf, "_ANSWER_CACHE", _empty_answer_cache())
+
+    assert lf._cached_answer(old, ("ShouldIRunMachineIntent", 180, 7.0), compute) == "<speak>24</speak>"
+    # Same content, even in a different object, is the same data version.
+    assert lf._cached_answer(same_prices, ("ShouldIRunMachineIntent", 180, 7.0), compute) == "<speak>24</speak>"
+    assert len(calls) == 1
+
+    # Different slot values are separate answers.
+    lf._cached_answer(old, ("ShouldIRunMachineIntent", 60, 7.0), compute)
+    assert len(calls) == 2
+
+    # New prices invalidate everything computed from the old ones.
+    assert lf._cached_answer(new, ("ShouldIRunMachineIntent", 180, 7.0), compute) == "<speak>48</speak>"
+    assert len(calls) == 3
+    assert list(lf._ANSWER_CACHE["regions"]["FI"]["answers"]) == [("ShouldIRunMachineIntent", 180, 7.0)]
+
+
+def test_answer_cache_invalidated_when_slot_rolls_over(monkeypatch):
+    from datetime import datetime, timedelta, timezone
+
+    start = datetime(2024, 3, 5, 9, tzinfo=timezone.utc)
+    series = _hourly_series(start, 24)
+    now = {"value": start + timedelta(minutes=10)}
+
+    class FakeDateTime:
+        @staticmethod
+        def now(tz=None):
+            return now["value"].astimezone(tz) if tz else now["value"]
+
+    monkeypatch.setattr(lf, "datetime", FakeDateTime)
+    monkeypatch.setattr(lf, "_ANSWER_CACHE", _empty_answer_cache())
+    calls = []
+
+    def compute(s):
+        calls.append(1)
+        return "<speak>x</speak>"
+
+    lf._cached_answer(series, ("CheapestPriceIntent",), compute)
+    now["value"] = start + timedelta(minutes=50)
+    lf._cached_answer(series, ("CheapestPriceIntent",), compute)
+    assert len(calls) == 1
+
+    now["value"] = start + timedelta(minutes=70)
+    lf._cached_answer(series, ("CheapestPriceIntent",), compute)
+    assert len(calls) == 2
+
+
+def _region_event(intent_name, region=None):
+    event = make_event("IntentRequest", intent_name=intent_name)
+    if region is not None:
+        event["request"]["intent"]["slots"] = {"region": {"name": "region", "value": region}}
+    return event
+
+
+def test_parse_region_accepts_codes_names_and_aliases():
+    assert lf._parse_region("se3") == "SE3"
+    assert lf._parse_region("SE 3") == "SE3"
+    assert lf._parse_region("no-5") == "NO5"
+    assert lf._parse_region("Finland") == "FI"
+    assert lf._parse_region("the Stockholm area") == "SE3"
+    assert lf._parse_region("Malmö area") == "SE4"
+    assert lf._parse_region("Sweden") == "SE3"
+    assert lf._parse_region("copenhagen") == "DK2"
+    assert lf._parse_region("Narnia") is None
+    assert lf._parse_region(None) is None
+
+
+def test_unknown_region_slot_gets_an_apology(monkeypatch):
+    monkeypatch.setattr(lf, "_download_price_entries", lambda: pytest.fail("unexpected download"))
+
+    resp = lf.lambda_handler(_region_event("GetSpotPriceIntent", "Narnia & co"), None)
+    ssml = resp["response"]["outputSpeech"]["ssml"]
+    assert "I don't have electricity prices for Narnia &amp; co." in ssml
+    assert any(v in ssml for v in lf.CLOSING_CUES)
+
+
+def test_regions_have_separate_caches_answers_and_store(monkeypatch, tmp_path):
+    from datetime import datetime, timezone
+
+    hour_start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    prices = {"FI": 0.05, "EE": 0.12}
+    downloads = []
+
+    def fake_download():
+        region = lf._current_region()
+        downloads.append(region)
+        return _hourly_series(hour_start, 24, price=prices[region]), None
+
+    monkeypatch.setattr(lf, "_PRICE_CACHES", {})
+    monkeypatch.setattr(lf, "_ANSWER_CACHE", _empty_answer_cache())
+    monkeypatch.setattr(lf, "PRICE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(lf, "_download_price_entries", fake_download)
+
+    fi = lf.lambda_handler(_region_event("GetSpotPriceIntent"), None)
+    ee = lf.lambda_handler(_region_event("GetSpotPriceIntent", "Estonia"), None)
+    lf.lambda_handler(_region_event("GetSpotPriceIntent", "EE"), None)
+
+    assert "in Finland is" in fi["response"]["outputSpeech"]["ssml"]
+    assert ">5.0<" in fi["response"]["outputSpeech"]["ssml"]
+    assert "in Estonia is" in ee["response"]["outputSpeech"]["ssml"]
+    assert ">12.0<" in ee["response"]["outputSpeech"]["ssml"]
+    assert downloads == ["FI", "EE"]
+    assert set(lf._ANSWER_CACHE["regions"]) == {"FI", "EE"}
+    assert lf._ANSWER_CACHE["hits"] == 1
+
+    store = lf.FilePriceStore()
+    assert store.load("FI")[0][0]["price"] == 0.05
+    assert store.load("EE")[0][0]["price"] == 0.12
+    assert store.load("LV") is None
+
+
+def test_warmup_refreshes_regions_concurrently(monkeypatch, tmp_path):
+    import threading
+    from datetime import datetime, timezone
+
+    hour_start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    # Each download waits for the other: they only finish if run at once.
+    both_started = threading.Barrier(2)
+
+    def fake_download():
+        both_started.wait(5)
+        return _hourly_series(hour_start, 24), None
+
+    monkeypatch.setattr(lf, "PRICE_REGIONS", ["FI", "SE3"])
+    monkeypatch.setattr(lf, "_PRICE_CACHES", {})
+    monkeypatch.setattr(lf, "_ANSWER_CACHE", _empty_answer_cache())
+    monkeypatch.setattr(lf, "PRICE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(lf, "_download_price_entries", fake_download)
+
+    result = lf.lambda_handler({"warmup": True}, None)
+    assert result["warmup"]["ok"]
+    assert set(result["warmup"]["regions"]) == {"FI", "SE3"}
+    assert set(lf._PRICE_CACHES) == {"FI", "SE3"}
+
+
+def test_breaker_is_per_region(monkeypatch):
+    import requests
+
+    class FailingSession:
+        def get(self, url, **kwargs):
+            raise requests.exceptions.ConnectionError()
+
+    monkeypatch.setattr(lf, "_HTTP_SESSION", FailingSession())
+    monkeypatch.setattr(lf, "CIRCUIT_FAILURE_THRESHOLD", 1)
+
+    token = lf._REQUEST_REGION.set("SE3")
+    try:
+        lf._download_price_entries()
+    finally:
+        lf._REQUEST_REGION.reset(token)
+
+    assert lf._upstream_breaker("SE3").state == lf.CircuitBreaker.OPEN
+    assert lf._upstream_breaker("FI").allow()
+
+
+@pytest.mark.parametrize("region, zone", [("SE3", "Europe/Stockholm"), ("NO1", "Europe/Oslo"), ("DK1", "Europe/Copenhagen")])
+def test_localize_moves_days_to_zone_time(region, zone):
+    from datetime import date, datetime
+
+    if lf._region_timezone(region) is None:
+        pytest.skip("no time zone database")
+
+    # 48 hours from midnight Finnish time, as the API serves them.
+    series = lf._series_from_payload(_payload(datetime.fromisoformat("2024-03-05T00:00:00+02:00"), 48, 60))
+    lf._localize(series, region)
+
+    assert str(series.tz) == zone
+    assert series.dt(0).hour == 23
+    # The local day starts an hour into the API's series.
+    start, end = series.day_range(date(2024, 3, 5))
+    assert (start, end) == (1, 25)
+
+
+def _device_event(intent_name, device_id="device-1"):
+    event = _region_event(intent_name)
+    event["context"] = {
+        "System": {
+            "device": {"deviceId": device_id},
+            "apiEndpoint": "https://api.amazonalexa.com",
+            "apiAccessToken": "token",
+        }
+    }
+    return event
+
+
+def test_device_region_looked_up_once_per_device(monkeypatch):
+    calls = []
+
+    class FakeSettingsResponse:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return "Europe/Oslo"
+
+    class FakeSession:
+        def get(self, url, **kwargs):
+            calls.append((url, kwargs["headers"]["Authorization"]))
+            return FakeSettingsResponse()
+
+    monkeypatch.setattr(lf, "_HTTP_SESSION", FakeSession())
+    monkeypatch.setattr(lf, "_DEVICE_REGIONS", {})
+    monkeypatch.setattr(lf, "DEVICE_REGIONS_MAX", 2)
+
+    assert lf._device_region(_device_event("GetSpotPriceIntent")) == "NO1"
+    assert lf._device_region(_device_event("CheapestPriceIntent")) == "NO1"
+    assert calls == [("https://api.amazonalexa.com/v2/devices/device-1/settings/System.timeZone", "Bearer token")]
+
+    # Only the most recently looked up devices are remembered.
+    lf._device_region(_device_event("GetSpotPriceIntent", "device-2"))
+    lf._device_region(_device_event("GetSpotPriceIntent", "device-3"))
+    assert list(lf._DEVICE_REGIONS) == ["device-2", "device-3"]
+
+    # Without the System context there is nothing to look up.
+    assert lf._device_region(_region_event("GetSpotPriceIntent")) is None
+
+
+def test_device_region_only_looked_up_for_price_intents(monkeypatch):
+    looked_up = []
+    monkeypatch.setattr(lf, "REGION_FROM_DEVICE", True)
+    monkeypatch.setattr(lf, "_device_region", lambda event: looked_up.append(1) or "SE3")
+    monkeypatch.setattr(lf, "get_spot_price_ssml", lambda: f"<speak>{lf._current_region()}</speak>")
+
+    lf.lambda_handler(_device_event("AMAZON.StopIntent"), None)
+    lf.lambda_handler(make_event("LaunchRequest"), None)
+    assert looked_up == []
+
+    resp = lf.lambda_handler(_device_event("GetSpotPriceIntent"), None)
+    assert "SE3" in resp["response"]["outputSpeech"]["ssml"]
+    # A spoken zone wins over the device's.
+    resp = lf.lambda_handler(_region_event("GetSpotPriceIntent", "Finland"), None)
+    assert "FI" in resp["response"]["outputSpeech"]["ssml"]
+    assert looked_up == [1]
+
+
+def test_fetch_regions_concurrently_under_shared_deadline(monkeypatch, tmp_path):
+    import asyncio
+    import threading
+    import time
+    from datetime import datetime, timezone
+
+    hour_start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    release = threading.Event()
+
+    def fake_download():
+        if lf._current_region() == "EE":
+            release.wait(5)
+        return _hourly_series(hour_start, 24), None
+
+    monkeypatch.setattr(lf, "_PRICE_CACHES", {})
+    monkeypatch.setattr(lf, "PRICE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(lf, "_download_price_entries", fake_download)
+
+    token = lf._REQUEST_DEADLINE.set(lf.Deadline(200))
+    started = time.monotonic()
+    try:
+        results = asyncio.run(lf.fetch_regions(["FI", "EE"]))
+    finally:
+        lf._REQUEST_DEADLINE.reset(token)
+        release.set()
+
+    assert time.monotonic() - started < 1
+    assert len(results["FI"][0]) == 24 and results["FI"][1] is None
+    assert results["EE"] == (None, lf.TIMEOUT_MESSAGE)
+
+
+def test_fetch_regions_of_nothing():
+    import asyncio
+
+    assert asyncio.run(lf.fetch_regions([])) == {}
+
+
+def test_async_warmup_keeps_loop_free(monkeypatch, tmp_path):
+    import asyncio
+    import threading
+    from datetime import datetime, timezone
+
+    hour_start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    release = threading.Event()
+
+    def slow_download():
+        if not release.wait(1):
+            return None, "the event loop was blocked"
+        return _hourly_series(hour_start, 24), None
+
+    monkeypatch.setattr(lf, "PRICE_REGIONS", ["FI"])
+    monkeypatch.setattr(lf, "_PRICE_CACHES", {})
+    monkeypatch.setattr(lf, "_ANSWER_CACHE", _empty_answer_cache())
+    monkeypatch.setattr(lf, "PRICE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(lf, "_download_price_entries", slow_download)
+
+    async def warmup_while_loop_runs():
+        warmup = asyncio.ensure_future(lf.async_lambda_handler({"warmup": True}, None))
+        # Only runs while the warmup waits if the loop isn't blocked.
+        await asyncio.sleep(0.01)
+        release.set()
+        return await warmup
+
+    assert asyncio.run(warmup_while_loop_runs())["warmup"]["ok"]
+
+
+def test_async_handler_serves_requests_concurrently(monkeypatch):
+    import asyncio
+    import threading
+
+    # Each answer waits for the other: they only finish if run at once.
+    both_started = threading.Barrier(2)
+
+    def fake_ssml():
+        both_started.wait(5)
+        return f"<speak>{lf._current_region()}</speak>"
+
+    monkeypatch.setattr(lf, "get_spot_price_ssml", fake_ssml)
+
+    async def both():
+        return await asyncio.gather(
+            lf.async_lambda_handler(_region_event("GetSpotPriceIntent", "Finland"), None),
+            lf.async_lambda_handler(_region_event("GetSpotPriceIntent", "Latvia"), None),
+        )
+
+    fi, lv = asyncio.run(both())
+    assert "<speak>FI " in fi["response"]["outputSpeech"]["ssml"]
+    assert "<speak>LV " in lv["response"]["outputSpeech"]["ssml"]
+
+
+def test_warmup_stops_waiting_at_invocation_deadline(monkeypatch, tmp_path):
+    import asyncio
+    import threading
+    from datetime import datetime, timezone
+
+    hour_start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    release = threading.Event()
+
+    def fake_download():
+        if lf._current_region() == "SE3":
+            release.wait(5)
+        return _hourly_series(hour_start, 24), None
+
+    monkeypatch.setattr(lf, "PRICE_REGIONS", ["FI", "SE3"])
+    monkeypatch.setattr(lf, "_PRICE_CACHES", {})
+    monkeypatch.setattr(lf, "_ANSWER_CACHE", _empty_answer_cache())
+    monkeypatch.setattr(lf, "PRICE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(lf, "_download_price_entries", fake_download)
+
+    context = FakeLambdaContext(lf.RESPONSE_RESERVE_MS + 200)
+    try:
+        result = asyncio.run(lf.async_lambda_handler({"warmup": True}, context))
+    finally:
+        release.set()
+
+    assert not result["warmup"]["ok"]
+    assert result["warmup"]["regions"]["FI"]["ok"]
+    assert result["warmup"]["regions"]["SE3"] == {"ok": False, "error": lf.TIMEOUT_MESSAGE}
+
+
+@pytest.fixture
+def hedging(monkeypatch):
+    from collections import deque
+
+    stats = {"calls": 0, "fired": 0, "won": 0}
+    monkeypatch.setattr(lf, "HEDGE_REQUESTS", True)
+    monkeypatch.setattr(lf, "HEDGE_DELAY_MS", 50)
+    monkeypatch.setattr(lf, "_FETCH_LATENCIES", deque(maxlen=200))
+    monkeypatch.setattr(lf, "_HEDGE_STATS", stats)
+    return stats
+
+
+def test_hedge_fires_after_delay_and_wins(monkeypatch, hedging):
+    import threading
+    import time
+
+    release = threading.Event()
+    responses = []
+
+    class FakeSession:
+        def get(self, url, **kwargs):
+            first = not responses
+            response = FakeResponse(ONE_PRICE)
+            responses.append(response)
+            if first:
+                release.wait(5)
+            return response
+
+    monkeypatch.setattr(lf, "_HTTP_SESSION", FakeSession())
+
+    entries, error = lf._download_price_entries()
+    release.set()
+    assert error is None and len(entries) == 1
+    assert hedging == {"calls": 1, "fired": 1, "won": 1}
+
+    # The slow first request is dropped as soon as it answers.
+    deadline = time.monotonic() + 5
+    while not responses[0].closed:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_hedge_not_fired_for_fast_response(monkeypatch, hedging):
+    calls = []
+
+    class FakeSession:
+        def get(self, url, **kwargs):
+            calls.append(url)
+            return FakeResponse(ONE_PRICE)
+
+    monkeypatch.setattr(lf, "_HTTP_SESSION", FakeSession())
+
+    entries, error = lf._download_price_entries()
+    assert error is None and len(calls) == 1
+    assert hedging == {"calls": 1, "fired": 0, "won": 0}
+
+
+def test_hedge_covers_failed_first_request(monkeypatch, hedging):
+    import threading
+
+    import requests
+
+    hedge_sent = threading.Event()
+    calls = []
+
+    class FakeSession:
+        def get(self, url, **kwargs):
+            calls.append(url)
+            if len(calls) == 1:
+                hedge_sent.wait(5)
+                raise requests.exceptions.ConnectionError()
+            hedge_sent.set()
+            return FakeResponse(ONE_PRICE)
+
+    monkeypatch.setattr(lf, "_HTTP_SESSION", FakeSession())
+
+    entries, error = lf._download_price_entries()
+    assert error is None and len(entries) == 1
+    assert hedging["won"] == 1
+    assert lf._upstream_breaker("FI").failures == 0
+
+
+def test_hedge_delay_follows_latency_percentile(monkeypatch, hedging):
+    assert lf._hedge_delay() == 0.05
+
+    lf._FETCH_LATENCIES.extend(i / 100 for i in range(1, 101))
+    monkeypatch.setattr(lf, "HEDGE_PERCENTILE", 95)
+    assert lf._hedge_delay() == 0.96
+    monkeypatch.setattr(lf, "HEDGE_PERCENTILE", 50)
+    assert lf._hedge_delay() == 0.51